@@ -1,9 +1,14 @@
-from .base import _Translater
-from .utils import coco_contour_to_cv2
-import re
-import cv2
-import json
-import gc
+from .base import _Translater, _Manifest
+from . import jsonio
+from .utils import coco_contours_to_buffer, polygon_area_and_bbox
+from .rle import rle_to_polygons
+from .svg import svg_to_contours
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
+import threading
+import uuid
+import os
 
 class AnnotoriousInterpreter(_Translater):
     """
@@ -11,62 +16,117 @@ class AnnotoriousInterpreter(_Translater):
     annotation into and from common objects in Context (COCO, cocodataset.org) label
     This method is modified from https://github.com/alexliyihao/auto-annotation-web
     """
-    def _set_meta():
+    def _set_meta(self):
         """
         set the meta setting of this translator
         The variables below are necessary but feel free to play with anything else.
         """
         self.format_name = "Annotorious"
+        # the validation stops after this many invalid annotations,
+        # a broken export is usually broken everywhere, no need to list them all
+        self.max_errors = 100
 
-    def _validate_new_format(self, data):
+    def _validate_new_format(self, data, workers = None):
         """
         validate the if the <data> is readable for Annotorious
+        every annotation is decoded ONCE here, and its svg selector parsed, the decoded dicts
+        are returned for _to_coco() with the parsed contours under "_contours",
+        all the invalid annotations (the selectors included) are reported together
+        rather than only the first one
         Args:
-            data: list[json], a list of annotorious annotations
+            data: list[json], a list of annotorious annotations, dicts or json strings
+            workers: int, the number of processes validating the annotations in chunks,
+                     None or 1 run in this process
         Return:
-            if <data> is interpretable in <format>, return true
-            else raise a AssertionError, ValueError, TypeError or KeyError
+            if <data> is interpretable in <format>, return list[dict], the decoded annotations
+            else raise a ValueError listing the invalid annotations
         """
-        return all([self._validate_annotorious_individual(self._dejsonized(annotation))
-                    for annotation in data])
+        data = list(data)
+        if workers is None or workers <= 1 or len(data) < 2 * workers:
+            annotations, errors = self._validate_chunk(data)
+        else:
+            # a few chunks per worker, so a slow chunk doesn't hold the others
+            chunk_size = -(-len(data) // (4 * workers))
+            starts = range(0, len(data), chunk_size)
+            with ProcessPoolExecutor(max_workers = workers) as executor:
+                results = list(executor.map(self._validate_chunk,
+                                            [data[start:start+chunk_size] for start in starts],
+                                            starts))
+            annotations = [annotation for chunk, _ in results for annotation in chunk]
+            errors = [error for _, chunk_errors in results for error in chunk_errors]
+        if errors:
+            count = f"{len(errors)}" if len(errors) < self.max_errors else f"at least {self.max_errors}"
+            listed = "; ".join(f"#{index}: {error}" for index, error in errors[:self.max_errors])
+            raise ValueError(f"{count} invalid annotations, {listed}")
+        return annotations
+
+    def _validate_chunk(self, data, start = 0):
+        """
+        helper function of _validate_new_format(), decode and validate a chunk of annotations
+        Args:
+            data: list[json], the annotations
+            start: int, the index of data[0] in all the annotations, for the error messages
+        Return:
+            annotations: list[dict], the decoded annotations, shallow copies with
+                         the contours of the selector under "_contours"
+            errors: list[tuple(int, str)], the index and the error of the invalid annotations,
+                    at most self.max_errors of them
+        """
+        annotations = []
+        errors = []
+        for index, annotation in enumerate(data, start):
+            try:
+                annotation = self._dejsonized(annotation)
+                self._validate_annotorious_individual(annotation)
+                # the selector is parsed here, so a malformed one is reported with the others,
+                # and _to_coco() doesn't parse it again
+                contours = svg_to_contours(annotation["target"]["selector"]["value"])
+                assert all(len(contour) for contour in contours), "empty polygon in the selector"
+                annotation = dict(annotation, _contours = contours)
+            except (AssertionError, ValueError, KeyError, TypeError, IndexError) as e:
+                errors.append((index, repr(e)))
+                if len(errors) >= self.max_errors:
+                    break
+            else:
+                annotations.append(annotation)
+        return annotations, errors
 
     def _validate_annotorious_individual(self,data):
         """
         individually check if each individual annotation is Annotorious format
         """
-        try:
-            assert data["type"] == "Annotation"
-            assert data["body"]
-            assert data["target"]
-            assert data["target"]["selector"]["type"] == "SvgSelector"
-            assert data["target"]["selector"]["value"]
-        except (AssertionError, KeyError):
-            raise
-        else:
-            return True
+        assert data["type"] == "Annotation", "not an Annotation"
+        assert data["body"], "empty body"
+        assert any(body.get("purpose") == "tagging" for body in data["body"]), "no tagging"
+        assert data["target"], "empty target"
+        assert data["target"]["selector"]["type"] == "SvgSelector", "not a SvgSelector"
+        assert data["target"]["selector"]["value"], "empty selector"
+        return True
 
     def _to_coco(self, data):
         """
         translate the annotorious annotations to COCO format
+        Args:
+            data: list[dict], the decoded annotations from _validate_new_format()
         """
         categories = {}
         annotations = []
-        images = self._image_processor()
+        images, image_ids = self._file_manager(data)
 
         for annotation in data:
             label = self._get_label(annotation)
             if label not in categories.keys():
                 categories[label] = len(categories)+1
             category_id = categories[label]
-            contour_numeric, area, bbox = self._process_contour(annotation)
+            contours, area, bbox = self._process_contour(annotation)
             annotations.append({
-                "segmentation": [contour_numeric],
+                "segmentation": contours,
                 "area": area,
                 "iscrowd": 0,
-                "image_id": 0,#TBF here
+                "image_id": image_ids[annotation["target"].get("source")],
                 "bbox": bbox,
                 "category_id": category_id,
-                "id": 0 #TBF here
+                "id": len(annotations)+1
             })
         categories = self._tidy_categories(categories)
         return {
@@ -75,26 +135,24 @@ class AnnotoriousInterpreter(_Translater):
                 "categories": categories
                 }
 
-    def _file_manager(self):
+    def _file_manager(self, data):
         """
-        To be finish: how should I encode with all the images?
+        the images are given by target.source of the annotations, one image each source,
+        the annotations without a source are considered from one unnamed image
         Args:
-            data: iterable(list[image], list[annotations]) all the data,
+            data: list[dict], the decoded annotations
         Return:
-            list[dict]: the "image" field of the coco format
-            dict{int,int}: the 1-many correspondence between image and annotations
-        {
-        "license": 4,
-        "file_name": "000000397133.jpg",
-        "coco_url": "http://images.cocodataset.org/val2017/000000397133.jpg",
-        "height": 427,
-        "width": 640,
-        "date_captured": "2013-11-14 17:02:52",
-        "flickr_url": "http://farm7.staticflickr.com/6116/6255196340_da26cf2c9e_z.jpg",
-        "id": 397133
-        },
-        """
-        return [],{}
+            list[dict]: the "image" field of the coco format, the height and width
+                        are not in the annotations, so they're not here either
+            dict{str,int}: the image id of each source
+        """
+        image_ids = {}
+        for annotation in data:
+            source = annotation["target"].get("source")
+            if source not in image_ids:
+                image_ids[source] = len(image_ids)+1
+        images = [{"file_name": source or "", "id": id} for source, id in image_ids.items()]
+        return images, image_ids
 
     def _tidy_categories(self, categories):
         """
@@ -121,93 +179,178 @@ class AnnotoriousInterpreter(_Translater):
         return tagging_list[0]
 
     def _process_contour(self, annotation):
-        # get the svg coordinate string
-        contour_string = annotation['target']["selector"]["value"]
-        # convert the string, I rounded the digit to 2 digit decimal,
-        # from the tradition of COCO officially release
-        contour_numeric = [round(float(i),2) for i in re.findall(r"[0-9]+.[0-9]+", contour_string)]
-        # reorganize them into points format, and convert it into a contour
-        points = coco_contour_to_cv2(contour_numeric, dtype = np.float32)
-        # compute the area -- dtype = float32 is necessary for the following
-        # is not working with float64 or double
-        area, bbox = self._area_and_bbox(points)
-        return contour_numeric, area, bbox
+        """
+        parse the svg selector of a individual annotation into coco format
+        args:
+            annotation: dict(json), a individual annotorious annotation
+        return:
+            contours: list[np.ndarray], the coco format contours, one for each
+                      polygon, or each sub-path of a path, serialized as they are by jsonio
+            area: float, the total area of the contours
+            bbox: tuple(int), the [x,y,w,h] bounding box of all the contours
+        """
+        # the contours parsed in the validation, or parse the svg coordinate string
+        contours = annotation.get("_contours")
+        if contours is None:
+            contours = svg_to_contours(annotation['target']["selector"]["value"])
+        # I rounded the digit to 2 digit decimal, from the tradition of COCO officially release
+        contours = [np.round(contour, 2) for contour in contours]
+        # compute the area and bbox of all the contours in one go,
+        # float32 as cv2 took, so the results are the same as before
+        points, offsets = coco_contours_to_buffer(contours, dtype = np.float32)
+        areas, bboxes = polygon_area_and_bbox(points, offsets)
+        x, y = bboxes[:, 0].min(), bboxes[:, 1].min()
+        w, h = (bboxes[:, 0] + bboxes[:, 2]).max() - x, (bboxes[:, 1] + bboxes[:, 3]).max() - y
+        return contours, float(areas.sum()), (int(x), int(y), int(w), int(h))
 
 #-------------------------The following is interpreting coco to annotorious------------------
 
-    def _from_coco(self, dst, coco_data):
+    def _from_coco(self, dst, coco_data, ndjson = False, writers = None, queue_depth = None,
+                   incremental = False):
         """
         translate the COCO format data to the annotorious annotations format
+        the annotations are serialized one by one and streamed into the output files,
+        rather than built as dicts and dumped at once
+        Args:
+            dst: str, the output folder
+            coco_data: json instance or CocoStream, the complete coco format
+            ndjson: bool, if True, all the annotations are written in one
+                    "annotations.ndjson" file, one annotation per line, and the image
+                    is given by target.source, else one .w3c.json file per image
+            writers: int, the number of threads writing the per-image files,
+                     None writes them in this thread
+            queue_depth: int, the number of images waiting to be written at most,
+                         2 * writers by default
+            incremental: bool, if True, the files whose image and annotations are unchanged
+                         since the last run are not written again, and a crashed run resumes,
+                         see base._Manifest. It needs one file per image, not ndjson
         """
+        if ndjson and incremental:
+            raise ValueError("the incremental mode needs one file per image, please don't use ndjson")
         # check if dst is there, if not create one
         os.makedirs(dst, exist_ok = True)
-        # distribute a color for all the categories
-        category_dict = self._extract_categories(coco_data["categories"])
+        # the category names are escaped once here, rather than once per annotation
+        category_dict = {id: jsonio.dumps(name)
+                         for id, name in self._extract_categories(self._coco_categories(coco_data)).items()}
         # generate a path dict for output
         path_dict = {}
-        # for each image
-        for image in coco_data["images"]:
-            # filter all the annotation which belongs to this image
-            annotations = [annotation in coco_data["annotations"] if annotation["image_id"] = image["id"]]
-            # translate all the related annotations into jsons
-            annotation_jsons = [anno for annotation in annotations for anno in self._interpret_annotation(annotation, category_dict)]
-            # define the output path
-            file_name = self._output_file_name(dst, image)
-            with open(os.path.join(dst, file_name), 'w') as output:
-                json.dump(data, output, ensure_ascii=False)
-            path_dict[image["id"]] = file_name
-            gc.collect()
+        if ndjson:
+            file_name = "annotations.ndjson"
+            with open(os.path.join(dst, file_name), "w", encoding = "utf-8", buffering = 1 << 20) as output:
+                for image, annotations in self._coco_groups(coco_data):
+                    source = jsonio.dumps(image["file_name"])
+                    for annotation in annotations:
+                        for annotation_json in self._interpret_annotation(annotation, category_dict, source):
+                            output.write(annotation_json)
+                            output.write("\n")
+                    path_dict[image["id"]] = file_name
+            return (dst, path_dict)
+
+        # the category names are in the outputs, they're part of the hashes
+        manifest_options = [self.format_name, coco_data["categories"]]
+        with _Manifest(dst, manifest_options, enabled = incremental) as manifest:
+            if writers is None:
+                for image, annotations in self._coco_groups(coco_data):
+                    # define the output path
+                    file_name = self._output_file_name(dst, image)
+                    path_dict[image["id"]] = file_name
+                    digest = manifest.changed(image, annotations, file_name)
+                    if digest is None:
+                        continue
+                    self._write_annotations(os.path.join(dst, file_name), annotations, category_dict)
+                    manifest.record(image["id"], digest, file_name)
+                return (dst, path_dict)
+
+            # bound the images waiting, so a CocoStream is not read into the memory ahead
+            slots = threading.BoundedSemaphore(queue_depth or 2 * writers)
+
+            def write(image, annotations, file_name, digest):
+                try:
+                    self._write_annotations(os.path.join(dst, file_name), annotations, category_dict)
+                    manifest.record(image["id"], digest, file_name)
+                finally:
+                    slots.release()
+
+            written = []
+            with ThreadPoolExecutor(max_workers = writers) as write_pool:
+                for image, annotations in self._coco_groups(coco_data):
+                    file_name = self._output_file_name(dst, image)
+                    path_dict[image["id"]] = file_name
+                    digest = manifest.changed(image, annotations, file_name)
+                    if digest is None:
+                        continue
+                    slots.acquire()
+                    written.append(write_pool.submit(write, image, annotations, file_name, digest))
+            # raise the error in writing, if there's any
+            for future in written:
+                future.result()
         return (dst, path_dict)
 
+    def _write_annotations(self, path, annotations, category_dict):
+        """
+        helper function of _from_coco(), stream the annotations of one image
+        into a W3C json array file
+        """
+        with open(path, "w", encoding = "utf-8", buffering = 1 << 20) as output:
+            output.write("[")
+            separator = ""
+            for annotation in annotations:
+                for annotation_json in self._interpret_annotation(annotation, category_dict):
+                    output.write(separator)
+                    output.write(annotation_json)
+                    separator = ","
+            output.write("]")
+
     def _output_file_name(self, dst, image):
         """
         generate a output file name
         """
-        output_path = f'{image["id"]}_{image["file_name"]}.w3c.json'
+        return f'{image["id"]}_{image["file_name"]}.w3c.json'
 
     def _extract_categories(self, coco_category):
         """
         extract category information from coco_data for fast access
         Args:
-            coco_category: json/dict instance, the category data
+            coco_category: dict{int: dict}, the categories by id, from _coco_categories()
         Return:
             category_dict: dict, the dict key is category id, and value is category_name
         """
-        return {category["id"]:category["name"]} for category in coco_category}
+        return {id:category["name"] for id, category in coco_category.items()}
 
-    def _interpret_annotation(self, annotation, category_dict):
+    def _interpret_annotation(self, annotation, category_dict, source = None):
         """
         given a COCO annotation segmentation (one annotation in ["annotation"]),
-        translate the format to a readable svg selector string
+        translate the format to W3C Annotorious json strings
         args:
-            contour: list, the segmentation contour of the annotation
+            annotation: dict, the COCO annotation
+            category_dict: dict, from category id to the category name as a json string
+            source: str, the image as a json string, for target.source, omitted if None
         returns:
-            polygon: string, the svg selector in Annotorious form
+            generator(str), one W3C annotation json for each contour
         """
         segmentation = annotation['segmentation']
+        # Annotorious only takes polygons, the RLE is traced into its outer contours
+        if isinstance(segmentation, dict):
+            segmentation = rle_to_polygons(segmentation)
         category_name = category_dict[annotation['category_id']]
         # each annotation may have more than one contours in their segmentation field
-        polygon_strings = [self._formatting_annotation(contours, category_name) for contours in segmentation]
-        return polygon_strings
+        return (self._formatting_annotation(contour, category_name, f"{annotation['id']}-{index}", source)
+                for index, contour in enumerate(segmentation))
 
-    def _formatting_annotation(self, contour, category_name):
+    def _formatting_annotation(self, contour, category_name, id, source = None):
         """
         formatting the annotation output into W3C Annotorious format
         the class label should be in TextualBody - tagging
         The svg selector string is from self._interpret_polygon()
+        the json is filled in a template directly, the points string only has
+        digits, ".", "-", "," and " ", so nothing else needs to be escaped
         """
-        return {
-            "type": "Annotation",
-            "body":[
-            {"type": "TextualBody", "value": category_name, "purpose": "tagging"}
-            ],
-            "target":{"selector":
-            {"type": "SvgSelector",
-             "value": self._interpret_polygon(contour)}
-            },
-            "@context": "http://www.w3.org/ns/anno.jsonld",
-            "id": "#725470be-7239-4e17-9850-48583eb7c2a5"
-        }
+        source = "" if source is None else f'"source":{source},'
+        return ('{"type":"Annotation",'
+                f'"body":[{{"type":"TextualBody","value":{category_name},"purpose":"tagging"}}],'
+                f'"target":{{{source}"selector":{{"type":"SvgSelector","value":"{self._interpret_polygon(contour)}"}}}},'
+                '"@context":"http://www.w3.org/ns/anno.jsonld",'
+                f'"id":"#{uuid.uuid5(uuid.NAMESPACE_OID, id)}"}}')
 
     def _interpret_polygon(self, contour):
         """
@@ -216,10 +359,16 @@ class AnnotoriousInterpreter(_Translater):
         args:
             contour: list, the segmentation contour of the annotation
         returns:
-            polygon: string, the svg selector in Annotorious form
+            polygon: string, the svg selector in Annotorious form, escaped for json
         """
-        contour = [[contour[2*i], contour[2*i+1]] for i in range(int(len(contour)/2))]
-        points = " ".join([",".join([str(points[0]), str(points[1])]) for points in contour])
-        prefix = '"<svg><polygon points=\\"'
-        suffix = '\\"/></svg>"'
-        return f"{prefix}{points}{suffix}"
+        # all the points are formatted in one % with a format string prepared for this length
+        points = _point_format(len(contour) // 2) % tuple(contour[:len(contour) // 2 * 2])
+        return f'<svg><polygon points=\\"{points}\\"></polygon></svg>'
+
+@lru_cache(maxsize = 1024)
+def _point_format(n_points):
+    """
+    the format string of <n_points> points, "x_1,y_1 x_2,y_2 ...", in 2 digit decimal
+    from the tradition of COCO officially release
+    """
+    return " ".join(["%.2f,%.2f"] * n_points)
@@ -1,11 +1,268 @@
 import json
-from datatime import datetime
-import json
+from collections import Counter, defaultdict
+from datetime import datetime
+import numpy as np
+import hashlib
+import copy
+import threading
 import os
+import re
+from .utils import polygon_area_and_bbox
+from . import jsonio
 
 class ValidationError(ValueError):
     pass
 
+class _JsonChunks(object):
+    """
+    helper class of iter_coco(), a json decoder working on a file chunk by chunk,
+    only the unread part of the current chunk is kept in the memory
+    """
+    _whitespace = re.compile(r"\s*")
+
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """
+        drop the part already decoded, then read the next chunk
+        """
+        chunk = self.file.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+
+    def peek(self):
+        """
+        skip the whitespaces, return the next character, or "" at the end of file
+        """
+        while True:
+            self.pos = self._whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos+1]
+            self._fill()
+
+    def consume(self, char):
+        """
+        consume the next character, which is supposed to be <char>
+        """
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting {char!r}", self.buffer, self.pos)
+        self.pos += 1
+
+    def decode(self):
+        """
+        decode the next complete json value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # a number at the end of the chunk might be cut, so it's only trusted
+                # when there's something after it
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            self._fill()
+
+def iter_coco(path, chunk_size = 1 << 20):
+    """
+    incrementally parse a COCO json file with the standard library,
+    the items in the top level arrays are decoded and yielded one by one,
+    so the whole document is never in the memory
+    Args:
+        path: str, the path of the COCO json file
+        chunk_size: int, the number of characters read each time
+    Yield:
+        tuple(str, object, bool), the top level field, the value,
+        and if the value is one item of an array field
+    """
+    with open(path, "r", encoding = "utf-8") as file:
+        reader = _JsonChunks(file, chunk_size)
+        reader.consume("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            field = reader.decode()
+            reader.consume(":")
+            if reader.peek() == "[":
+                reader.consume("[")
+                if reader.peek() != "]":
+                    while True:
+                        yield field, reader.decode(), True
+                        if reader.peek() != ",":
+                            break
+                        reader.consume(",")
+                reader.consume("]")
+            else:
+                yield field, reader.decode(), False
+            if reader.peek() != ",":
+                break
+            reader.consume(",")
+        reader.consume("}")
+
+class CocoStream(object):
+    """
+    a COCO json file read with iter_coco(), passed to from_coco() instead of the dict
+    when the file is too large to be loaded
+
+    Everything except "annotations" is small and is read in the first pass,
+    coco_stream["annotations"] is re-read lazily from the file every time it's iterated
+    """
+    def __init__(self, path, chunk_size = 1 << 20):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._fields = None
+        self._annotation_counts = None
+
+    def _scan(self):
+        """
+        the first pass: keep all the fields except "annotations",
+        and count the annotations of each image
+        """
+        fields = {}
+        annotation_counts = Counter()
+        for field, value, is_item in iter_coco(self.path, self.chunk_size):
+            if field == "annotations":
+                annotation_counts[value["image_id"]] += 1
+            elif is_item:
+                fields.setdefault(field, []).append(value)
+            else:
+                fields[field] = value
+        self._fields = fields
+        self._annotation_counts = annotation_counts
+
+    def annotation_counts(self):
+        """
+        return:
+            Counter{int: int}, the number of annotations of each image_id
+        """
+        if self._annotation_counts is None:
+            self._scan()
+        return self._annotation_counts
+
+    def __getitem__(self, field):
+        if field == "annotations":
+            return _CocoAnnotations(self)
+        if self._fields is None:
+            self._scan()
+        return self._fields[field]
+
+class _CocoAnnotations(object):
+    """
+    helper class of CocoStream, the lazy "annotations" field
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __iter__(self):
+        return (value for field, value, is_item in iter_coco(self.stream.path, self.stream.chunk_size)
+                if field == "annotations")
+
+    def __len__(self):
+        return sum(self.stream.annotation_counts().values())
+
+class _Manifest(object):
+    """
+    the content-hash manifest of an incremental _from_coco(): each image id is saved with
+    a hash of the image, its annotations and the output options, and the output file.
+    An image is only written again if its hash changed or its file is gone.
+    The manifest is <dst>/.manifest.ndjson, one line is appended and flushed after each
+    file is written, so a crashed run resumes from where it stopped; it's compacted
+    when the run finishes, only keeping the images of this run.
+    When it's not enabled, every image is considered changed and nothing is saved.
+    """
+    file_name = ".manifest.ndjson"
+
+    def __init__(self, dst, options, enabled = True):
+        """
+        Args:
+            dst: str, the output folder
+            options: the options changing the outputs, e.g. the palette, they're part of the hash
+            enabled: bool, if False, it's a manifest doing nothing
+        """
+        self.dst = dst
+        self.enabled = enabled
+        self.options = jsonio.dumps(options)
+        self.path = os.path.join(dst, self.file_name)
+        self.entries = {}
+        self.seen = set()
+        self._lock = threading.Lock()
+        self._file = None
+        if not enabled:
+            return
+        if os.path.isfile(self.path):
+            with open(self.path, "rb") as manifest:
+                for line in manifest:
+                    try:
+                        entry = jsonio.loads(line)
+                    # the last line may be cut by a crash
+                    except jsonio.JSONDecodeError:
+                        continue
+                    self.entries[entry["image_id"]] = (entry["hash"], entry["path"])
+        self._file = open(self.path, "a", encoding = "utf-8")
+
+    def changed(self, image, annotations, file_name):
+        """
+        check if an image needs to be written
+        Args:
+            image: dict, the image in the coco format
+            annotations: list[dict], all the annotations of the image
+            file_name: str, the output file name in dst
+        Return:
+            str, the hash of the image to be recorded after it's written,
+            or None if the file is up-to-date
+        """
+        if not self.enabled:
+            return ""
+        self.seen.add(image["id"])
+        content = f'{self.options}{jsonio.dumps(image)}{jsonio.dumps(annotations)}'
+        digest = hashlib.blake2b(content.encode("utf-8"), digest_size = 16).hexdigest()
+        if self.entries.get(image["id"]) == (digest, file_name) \
+           and os.path.isfile(os.path.join(self.dst, file_name)):
+            return None
+        return digest
+
+    def record(self, image_id, digest, file_name):
+        """
+        record an image after its file is written, it's thread-safe
+        """
+        if not self.enabled:
+            return
+        line = jsonio.dumps({"image_id": image_id, "hash": digest, "path": file_name})
+        with self._lock:
+            self.entries[image_id] = (digest, file_name)
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        """
+        close the manifest, compact it if the run finished without an error
+        """
+        if not self.enabled:
+            return
+        self._file.close()
+        if error_type is not None:
+            return
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding = "utf-8") as manifest:
+            for image_id, (digest, file_name) in self.entries.items():
+                if image_id in self.seen:
+                    manifest.write(jsonio.dumps({"image_id": image_id, "hash": digest, "path": file_name}) + "\n")
+        os.replace(temporary, self.path)
+
 class _Translater(object):
     """
     base class of all the translators convert annotation into and from
@@ -17,30 +274,42 @@ class _Translater(object):
     to_coco() and from_coco() public methods, all exceptions are solved internally
     """
 
-    def __init__(self):
+    def __init__(self, coco_meta = None):
         """
         initialization of the class
+        Args:
+            coco_meta: dict or str, the "info" of the COCO outputs, a dict, or the path
+                       of a json file of it, the missing fields are from the environment,
+                       see _coco_meta()
         """
         self._set_meta()
+        self.coco_meta = coco_meta
+        # the "info" and the license files are resolved once per translator,
+        # so to_coco() never waits for anything in a batch job
+        self._coco_meta_cache = None
+        self._licenses_cache = {}
 
-    def _set_meta():
+    def _set_meta(self):
         """
         please override this: set the meta setting of this translator
         The variables below are necessary but feel free to play with anything else.
         """
         self.format_name = "new_format_name"
 
-    def _validate_new_format(self, data):
+    def _validate_new_format(self, data, workers = None):
         """
         please override this:
         validate the if the <data> is readable for the new format
         Args:
             data: json,numpy array, or whatever other future format the data input
+            workers: int, the number of processes validating, if the format can be
+                     validated in parallel
         Return:
-            if <data> is interpretable in <format>, return true
+            if <data> is interpretable in <format>, return the data ready for _to_coco(),
+            so anything decoded or normalized during the validation is not done again,
             else raise a AssertionError, ValueError or KeyError
         """
-        pass
+        return data
 
     def _to_coco(self, data):
         """
@@ -87,56 +356,123 @@ class _Translater(object):
         else:
             return True
 
+    def _coco_index(self, coco_data):
+        """
+        index the coco data once per call, so every image finds its annotations
+        in O(1) rather than filtering all the annotations again
+        Args:
+            coco_data: dict, the coco-format annotations
+        Return:
+            annotation_index: dict{int: list[dict]}, the annotations grouped by image_id
+            category_index: dict{int: dict}, the categories by id
+        """
+        annotation_index = defaultdict(list)
+        for annotation in coco_data["annotations"]:
+            annotation_index[annotation["image_id"]].append(annotation)
+        return dict(annotation_index), self._coco_categories(coco_data)
+
+    def _coco_categories(self, coco_data):
+        """
+        Return:
+            category_index: dict{int: dict}, the categories by id
+        """
+        return {category["id"]: category for category in coco_data["categories"]}
+
+    def _coco_groups(self, coco_data):
+        """
+        yield every image with all its annotations
+        if <coco_data> is a dict, the annotations are indexed by _coco_index(),
+        if it's a CocoStream, the annotations are read in a second pass, and an image
+        is yielded as soon as all its annotations are read, so only the images with
+        annotations pending are kept -- which is bounded when the file is written
+        image by image, as most of the exporters do
+        Args:
+            coco_data: dict or CocoStream, the coco-format annotations
+        Yield:
+            tuple(dict, list[dict]), the image and its annotations
+        """
+        if not isinstance(coco_data, CocoStream):
+            annotation_index, _ = self._coco_index(coco_data)
+            for image in coco_data["images"]:
+                yield image, annotation_index.get(image["id"], [])
+            return
+        images = {image["id"]: image for image in coco_data["images"]}
+        annotation_counts = coco_data.annotation_counts()
+        pending = defaultdict(list)
+        for annotation in coco_data["annotations"]:
+            image_id = annotation["image_id"]
+            pending[image_id].append(annotation)
+            if len(pending[image_id]) == annotation_counts[image_id]:
+                annotations = pending.pop(image_id)
+                # the same as the dict, the annotations without an image are ignored
+                if image_id in images:
+                    yield images.pop(image_id), annotations
+        # the images without any annotation
+        for image in images.values():
+            yield image, []
+
     def _dejsonized(self, data):
         """
         helper function that automatically unify the data type:
-        if data is a str (which expected from a web json),
-        automatically load it as a dict, and pass the dict if it is.
+        if data is a str or bytes (which expected from a web json),
+        automatically load it as a dict, and pass the dict (or CocoStream) if it is.
         Else it will raise a TypeError
         """
-        if isinstance(data, str):
-            return json.loads(data)
-        elif isinstance(data, dict):
+        if isinstance(data, (str, bytes)):
+            return jsonio.loads(data)
+        elif isinstance(data, (dict, CocoStream)):
             return data
         else:
             raise TypeError(f"{type(data)}")
 
-    def validate_new_format(self, data):
+    def validate_new_format(self, data, workers = None):
         """
         wrapper of _validate_new_format
         if the <data> is readable for the new format
         Args:
             data: json,numpy array, or whatever other future format the data input
+            workers: int, the number of processes validating, see _validate_new_format()
         Return:
-            if <data> is interpretable in <format>, return true
+            if <data> is interpretable in <format>, return the validated data
             else raise a ValidationError
         """
         try:
-            self._validate_new_format(data)
+            return self._validate_new_format(data, workers = workers)
         except(AssertionError, ValueError, KeyError, TypeError) as e:
             raise ValidationError(f"There're some data not acceptable as {self.format_name} format: {repr(e)}")
 
     def _coco_meta(self):
         """
-        prepare a meta information for COCO format
-        """
-        now = datetime.now()
-        version = input("Please give a version code: ")
-        contributor = input("Please give a contributor name")
-        url = input("Please give a url to the dataset")
-        return {
-                "year": now.strftime("%Y"),
-                "version": version,
-                "description": "Exported from Mirrorstoolkit",
-                "contributor": contributor,
-                "url": url,
-                "date_created": now.strftime("%Y-%M-%dT%H:%M:%S")
-            }
+        prepare a meta information for COCO format, it's resolved at the first call
+        and cached, in the order of:
+            the fields in self.coco_meta, a dict or the path of a json file
+            the environment variables MIRRORSTOOLKIT_COCO_VERSION,
+            MIRRORSTOOLKIT_COCO_CONTRIBUTOR and MIRRORSTOOLKIT_COCO_URL
+            "" if none of above is given
+        """
+        if self._coco_meta_cache is None:
+            now = datetime.now()
+            meta = {
+                    "year": now.strftime("%Y"),
+                    "version": os.environ.get("MIRRORSTOOLKIT_COCO_VERSION", ""),
+                    "description": "Exported from Mirrorstoolkit",
+                    "contributor": os.environ.get("MIRRORSTOOLKIT_COCO_CONTRIBUTOR", ""),
+                    "url": os.environ.get("MIRRORSTOOLKIT_COCO_URL", ""),
+                    "date_created": now.strftime("%Y-%m-%dT%H:%M:%S")
+                }
+            coco_meta = self.coco_meta
+            if isinstance(coco_meta, str):
+                coco_meta = jsonio.load(coco_meta)
+            meta.update(coco_meta or {})
+            self._coco_meta_cache = meta
+        # a copy, so the outputs don't share one dict
+        return dict(self._coco_meta_cache)
 
     def _coco_licenses_prepraration(self, path = None):
         """
         Prepare the license field
         if a json file path is not given, a by-nc-sa license is given as default
+        the license file is only read at the first time it's given
         """
         if path == None:
             return  {"url": "http://creativecommons.org/licenses/by-nc-sa/2.0/",
@@ -149,32 +485,41 @@ class _Translater(object):
             except AssertionError:
                 print("The license file is not a valid json file")
             else:
-                return json.load(path)
+                if path not in self._licenses_cache:
+                    self._licenses_cache[path] = jsonio.load(path)
+                # a copy, as _coco_meta(), so editing the licenses of one output doesn't
+                # change the later ones, the licenses can be nested (a list of dicts)
+                return copy.deepcopy(self._licenses_cache[path])
 
     def _area_and_bbox(self, contours):
         """
         utility functions compute the area and bounding boxes
         args:
-            points, list[list[float,float]], the points of the contour
+            contours, list[list[float,float]], the points of the contour
+        it's a thin wrapper of utils.polygon_area_and_bbox() for one contour,
+        please call that directly with a point buffer when there're many
         """
-        # compute the area -- dtype = float32 is necessary for the following
-        # is not working with float64 or double
-        area = cv2.contourArea(np.array(points, dtype = np.float32))
+        # float32 as cv2 was given before, so the points are rounded the same
+        points = np.asarray(contours, dtype = np.float32).reshape(-1, 2)
+        areas, bboxes = polygon_area_and_bbox(points, [0, len(points)])
         # bounding box, please be noticed that it's [x,y,w,h] format
-        bbox = cv2.boundingRect(np.array(points, dtype = np.float32))
-        return area, bbox
+        return float(areas[0]), tuple(bboxes[0].tolist())
 
-    def to_coco(self, data, license_file, **kwargs):
+    def to_coco(self, data, license_file, validation_workers = None, **kwargs):
         """
         The wrapper including the complete procedure translating the data to COCO
         please be noticed that data is ONE parameter
+        validation_workers is the number of processes validating <data>, if the
+        format supports it, the other keyword arguments are passed to _to_coco()
         """
         try:
-            self.validate_new_format(data)
+            # the translation takes the validated data, so nothing is decoded twice
+            data = self.validate_new_format(data, workers = validation_workers)
+            # streaming inputs can only be validated item by item during the translation
+            coco_output = self._to_coco(data,**kwargs)
         except ValidationError as e:
             return str(e)
         else:
-            coco_output = self._to_coco(data,license_file,**kwargs)
             coco_output["info"] = self._coco_meta()
             coco_output["licenses"] = self._coco_licenses_prepraration(license_file)
             return coco_output
@@ -183,10 +528,12 @@ class _Translater(object):
         """
         The wrapper including the complete procedure
         translating COCO to specific format
+        <data> is a dict, a json string, or a CocoStream for the files too large to be loaded
         """
         try:
+            data = self._dejsonized(data)
             self._validate_coco(data)
-        except ValidationError as e:
+        except (ValidationError, TypeError) + jsonio.JSONDecodeError as e:
             return str(e)
         else:
             format_output = self._from_coco(dst,data,**kwargs)
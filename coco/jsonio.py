@@ -0,0 +1,114 @@
+"""
+the json backend of the coco package, every json parsed or written in the package
+goes through here: orjson is used if it's installed, then ujson, then the standard json.
+The numpy arrays and scalars (e.g. the contours from cv2) are serialized directly,
+orjson writes them natively, the others convert them in a default hook
+"""
+import numpy as np
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# orjson.JSONDecodeError is a json.JSONDecodeError already, ujson raises its own
+JSONDecodeError = (json.JSONDecodeError,) + ((ujson.JSONDecodeError,) if ujson is not None else ())
+
+def available_backends():
+    """
+    return:
+        list[str], the backends installed, in the order of preference
+    """
+    return [name for name, module in (("orjson", orjson), ("ujson", ujson), ("json", json))
+            if module is not None]
+
+_backend = available_backends()[0]
+
+def get_backend():
+    """
+    return:
+        str, the name of the backend in use
+    """
+    return _backend
+
+def set_backend(name):
+    """
+    choose the backend, e.g. for a benchmark or to reproduce a standard json output
+    args:
+        name: str, in "orjson", "ujson" or "json"
+    """
+    global _backend
+    if name not in available_backends():
+        raise ValueError(f"the json backend {name} is not available, please choose in {available_backends()}")
+    _backend = name
+
+def _default(obj):
+    """
+    the default hook of json and ujson, for the numpy types they don't know
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def loads(data):
+    """
+    parse a json document
+    args:
+        data: str or bytes, the json
+    return:
+        the decoded object
+    """
+    if _backend == "orjson":
+        return orjson.loads(data)
+    if _backend == "ujson":
+        return ujson.loads(data)
+    return json.loads(data)
+
+def dumps(obj):
+    """
+    serialize <obj> into a compact json string, the non-ascii characters are kept as they are
+    args:
+        obj: the object, numpy arrays and scalars included
+    return:
+        str, the json
+    """
+    if _backend == "orjson":
+        # the non-contiguous arrays and the dtypes orjson doesn't take go to _default
+        return orjson.dumps(obj, default = _default, option = orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+    if _backend == "ujson":
+        return ujson.dumps(obj, ensure_ascii = False, default = _default)
+    return json.dumps(obj, ensure_ascii = False, separators = (",", ":"), default = _default)
+
+def load(path):
+    """
+    parse a json file
+    args:
+        path: str, the path of the json file
+    return:
+        the decoded object
+    """
+    with open(path, "rb") as file:
+        return loads(file.read())
+
+def dump(obj, path):
+    """
+    write <obj> into a json file
+    args:
+        obj: the object, numpy arrays and scalars included
+        path: str, the path of the json file
+    """
+    if _backend == "orjson":
+        # orjson gives utf-8 bytes, written as they are
+        with open(path, "wb") as file:
+            file.write(orjson.dumps(obj, default = _default, option = orjson.OPT_SERIALIZE_NUMPY))
+        return
+    with open(path, "w", encoding = "utf-8") as file:
+        file.write(dumps(obj))
@@ -1,10 +1,52 @@
-from .base import _Translater
-from .utils import coco_contour_to_cv2
+from .base import _Translater, _Manifest, ValidationError
+from .utils import coco_contour_to_cv2, coco_contours_to_buffer, polygon_area_and_bbox, \
+                   pack_color, pack_label_map, unique_labels, label_regions
+from .rle import rle_encode, rle_decode, rle_to_string
 import numpy as np
 import cv2
 import seaborn as sns
+import PIL.Image as Img
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import threading
+import re
 import os
-import gc
+
+class _CanvasPool(object):
+    """
+    a size-keyed pool of canvases for MaskInterpreter._from_coco(),
+    the images in the same size reuse the same buffers rather than allocating new ones
+    """
+    def __init__(self, size = 8):
+        """
+        Args:
+            size: int, the number of free canvases kept for each shape at most
+        """
+        self.size = size
+        self._free = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def get(self, shape, dtype = np.uint8):
+        """
+        get a zero-filled canvas in <shape> and <dtype>, reused if there's a free one
+        """
+        with self._lock:
+            free = self._free.get((shape, np.dtype(dtype)))
+            canvas = free.pop() if free else None
+        if canvas is None:
+            return np.zeros(shape, dtype = dtype)
+        canvas.fill(0)
+        return canvas
+
+    def put(self, canvas):
+        """
+        give a canvas back to the pool when it's not used anymore
+        """
+        with self._lock:
+            free = self._free[(canvas.shape, canvas.dtype)]
+            if len(free) < self.size:
+                free.append(canvas)
 
 class MaskInterpreter(_Translater):
     """
@@ -17,77 +59,200 @@ class MaskInterpreter(_Translater):
     and is inspired by https://www.immersivelimit.com/create-coco-annotations-from-scratch,
     the re-implementation optimized the efficiency and dependent packages
     """
-    def _set_meta():
+    def _set_meta(self):
         """
         please override this: set the meta setting of this translator
         The variables below are necessary but feel free to play with anything else.
         """
         self.format_name = "pixel mask"
 
-    def _validate_new_format(self, data):
+    def _validate_new_format(self, data, workers = None):
         """
         please override this:
         validate the if the <data> is readable for <format>
         Args:
-            data: tuple(img, mask, dictionary)
+            data: tuple(img, mask, dictionary) or tuple(source, dictionary)
                   img and mask are supposed to be np.ndarray
-                  or some format can be translated by np.array(img) and np.array(mask)
-                  dictionary are supposed to be dict
+                  or some format can be translated by np.array(img) and np.array(mask),
+                  or lists of their paths
+                  source is a directory or an iterable of (image_path, mask_path) pairs,
+                  see _mask_pairs()
+                  dictionary are supposed to be dict, from the RGB color to the category name,
+                  the alpha channel of the RGBA masks is ignored
+            workers: int, not used, the masks given as paths are validated
+                     in the workers of _translate_mask()
         Return:
-            if <data> is interpretable in <format>, return true
+            if <data> is interpretable in <format>, return <data>
             else raise a AssertionError
         """
+        # extract dictionary
+        label_dictionary = data[-1]
+        assert isinstance(label_dictionary, dict)
+
+        # the streaming input is validated pair by pair in _to_coco(),
+        # as a generator can only be read once and the masks are not loaded yet
+        if len(data) == 2:
+            source = data[0]
+            if isinstance(source, str):
+                assert os.path.isdir(source), source
+            return data
+
         #extract img
         imgs = data[0]
-        # if it's not a np.ndarray, convert it, most of the times it's not hard...
-        if not isinstance(imgs, np.ndarray):
-            imgs = np.array(imgs)
         # extract mask
         masks = data[1]
-        # if it's not a np.ndarray, convert it, most of the times it's not hard...
-        if not isinstance(masks, np.ndarray):
-            masks = np.array(masks)
+        assert len(imgs) == len(masks)
+        # if the masks are given as paths, only check the files are there,
+        # they are decoded later in _translate_mask() rather than all loaded here
+        if all(isinstance(mask, str) for mask in masks):
+            for mask in masks:
+                assert os.path.isfile(mask), mask
+            return data
+        # the memory-mapped masks are not read in full, their labels are checked in _translate_mask()
+        if all(isinstance(mask, np.memmap) for mask in masks):
+            for img, mask in zip(imgs, masks):
+                self._validate_pair(img, mask)
+            return data
 
-        # assert all pixels are labeled
-        assert imgs.shape == masks.shape
+        category_ids = self._category_ids(label_dictionary)
+        for img, mask in zip(imgs, masks):
+            # if it's not a np.ndarray, convert it, most of the times it's not hard...
+            # and a RGBA mask loses its alpha, as in _read_mask()
+            mask = self._read_mask(mask)
+            self._validate_pair(img, mask)
+            # assert that all the labels in the mask are in the dictionary
+            # Please be noticed that the reverse is not supposed to be always true
+            for label in unique_labels(pack_label_map(mask)).tolist():
+                assert label == 0 or label in category_ids, f"unknown label {label}"
 
-        # extract dictionary
-        label_dictionary = data[2]
-        assert isinstance(label_dictionary, dict)
-
-        # assert that all the labels in the mask are in the dictionary
-        # Please be noticed that the reverse is not supposed to be always true
-        labels_used = np.unique(masks)
-        for i in labels_used:
-            assert i in label_dictionary.keys()
-
-        return True
+        return data
 
+    def _validate_pair(self, img, mask):
+        """
+        helper function of _validate_new_format() and _translate_pair(),
+        validate one image and its decoded mask
+        Args:
+            img: np.ndarray or str, the image or the path of the image
+            mask: np.ndarray, the decoded mask
+        """
+        # only the header is read when img is a path
+        if isinstance(img, str):
+            with Img.open(img) as image:
+                width, height = image.size
+        else:
+            height, width = np.shape(img)[:2]
+        # assert all pixels are labeled
+        assert (height, width) == mask.shape[:2], f"image {(height, width)} and mask {mask.shape[:2]}"
 
-    def _to_coco(self, data):
+    def _to_coco(self, data, workers = None, rle = False, tolerance = 0, max_points = None, holes = "fill",
+                 tile_size = None, tile_workers = None, mode = "color", array_cache = None):
         """
         translate the mask data to COCO format
+        Args:
+            data: tuple(imgs, masks, label_dictionary) or tuple(source, label_dictionary),
+                  see _validate_new_format()
+            workers: int, the number of processes extracting the contours,
+                     None or 1 run in this process. When working in parallel,
+                     please give the masks as file paths, so each worker decodes
+                     its own mask rather than receiving a pickled array
+            rle: bool, if True, each label is saved as an iscrowd=1 compressed RLE,
+                 which keeps all the components and holes, and is much smaller than
+                 polygons for the large or fragmented regions
+            tolerance: float, in pixel, the polygons are simplified by cv2.approxPolyDP
+                       with this tolerance, 0 keeps all the points from cv2.findContours
+            max_points: int, the number of points of an annotation at most, the tolerance
+                        is raised until the polygons fit, then the smallest components
+                        are dropped if they still don't, None for no limit
+            holes: str, in "fill" or "rle", COCO polygons can't have holes, with "fill"
+                   the holes are filled, with "rle" the labels with holes are saved as RLE
+            tile_size: int, if given, each mask is read and traced in tiles of this size, for the
+                       masks too large to be held in the memory, please give them as np.memmap
+                       or .npy files so only a window is read at a time, see _extract_labels_tiled().
+                       The tiled mode only writes polygons with the holes filled
+            tile_workers: int, the number of threads tracing the tiles of a mask
+            mode: str, in "color" or "category", the same as _from_coco(): the masks are
+                  3-channel colors, or 1-channel category ids (8 or 16-bit), then the keys
+                  of the label dictionary are the ids, and a palettized png is read as
+                  its indices rather than its colors
+            array_cache: vision.array_cache.ArrayCache, optional, a cache of the masks built with
+                         decode = "unchanged", the mask paths found in it are served from its
+                         memory map rather than decoded again, the others are decoded as usual
         """
+        assert mode in ["color", "category"]
+        assert holes in ["fill", "rle"]
+        assert tile_size is None or (not rle and holes == "fill"), "the tiled mode only writes polygons"
         # the data is supposed to be passed in as a iterable
-        imgs, masks, label_dictionary = data
-        annotations = []
-        images, annotation_dict = self._to_coco_file_manage()
-        categories = self._tidy_categories(label_dictionary)
-        annotations = self._translate_mask(masks, label_dictionary, annotation_dict)
+        pairs, label_dictionary = self._mask_pairs(data)
+        categories = self._tidy_categories(label_dictionary, mode)
+        images, annotations = self._translate_mask(pairs, label_dictionary, workers = workers, rle = rle,
+                                                   tolerance = tolerance, max_points = max_points,
+                                                   holes = holes, tile_size = tile_size,
+                                                   tile_workers = tile_workers, mode = mode,
+                                                   array_cache = array_cache)
         return {
                 "images":images,
                 "annotations": annotations,
                 "categories": categories
                 }
 
-    def _to_coco_file_manage(self):
+    def _mask_pairs(self, data):
+        """
+        unify the input of _to_coco() into an iterable of (image, mask) pairs,
+        nothing is read here, so a generator stays lazy
+        Args:
+            data: tuple(imgs, masks, label_dictionary) or tuple(source, label_dictionary),
+                  if source is a directory, every "*_mask.png" in it is translated, with its
+                  image in the same directory if it's there, see _mask_image_names()
+        Return:
+            iterable(tuple(image, mask)), the image and mask, or their paths,
+            the image is None for a mask without its image
+            dict, the label dictionary
+        """
+        if len(data) == 3:
+            imgs, masks, label_dictionary = data
+            return zip(imgs, masks), label_dictionary
+        source, label_dictionary = data
+        if isinstance(source, str):
+            directory, suffix = source, "_mask.png"
+            source = ((self._mask_image(os.path.join(directory, file_name)), os.path.join(directory, file_name))
+                      for file_name in sorted(os.listdir(directory)) if file_name.endswith(suffix))
+        return source, label_dictionary
+
+    def _mask_image_names(self, mask_path):
+        """
+        helper function of _mask_pairs(), the possible image file names of a mask file:
+        "<name>_mask.png" is the mask of "<name>", and _from_coco() writes the mask of
+        the image "<file_name>" as "<id>_<file_name>_mask.png"
+        Return:
+            list[str], the names, the name in _from_coco() naming last
+        """
+        stem = os.path.basename(mask_path)[:-len("_mask.png")]
+        match = re.match(r"\d+_(.+)$", stem)
+        return [stem, match.group(1)] if match else [stem]
+
+    def _mask_image(self, mask_path):
+        """
+        helper function of _mask_pairs(), the path of the image of a mask file,
+        None if it's not next to the mask (e.g. a _from_coco() output holds the masks only),
+        the size is then taken from the mask
         """
-        To be finish: how should I encode with all the images?
+        directory = os.path.dirname(mask_path)
+        for name in self._mask_image_names(mask_path):
+            if os.path.isfile(os.path.join(directory, name)):
+                return os.path.join(directory, name)
+        return None
+
+    def _to_coco_file_manage(self, img, mask, id, mask_path = None):
+        """
+        generate the "images" field entry of one image
         Args:
-            data: iterable(image, mask, annotations) all the data,
+            img: np.ndarray or str, the image or the path of the image, or None
+            mask: np.ndarray, the decoded mask
+            id: int, the image id
+            mask_path: str, the path of the mask, the file name is taken from it
+                       when <img> is None, see _mask_image_names()
         Return:
-            list[dict]: the "image" field of the coco format
-            dict{int,int}: the 1-many correspondence between image and annotations
+            dict: the "image" field entry of the coco format, e.g.
         {
         "license": 4,
         "file_name": "000000397133.jpg",
@@ -99,111 +264,784 @@ class MaskInterpreter(_Translater):
         "id": 397133
         },
         """
-        return [],{}
+        if isinstance(img, str):
+            file_name = os.path.basename(img)
+        elif img is None and isinstance(mask_path, str):
+            file_name = self._mask_image_names(mask_path)[-1]
+        else:
+            file_name = None
+        return {"file_name": file_name,
+                "height": mask.shape[0],
+                "width": mask.shape[1],
+                "id": id}
 
-    def _tidy_categories(self, categories):
+    def _tidy_categories(self, categories, mode = "color"):
         """
         re-format categories dictionary, this funtion might need later modification
+        in "color" mode the ids are the order of the colors from 1,
+        in "category" mode the keys are the category ids already, and kept
         """
         # current setting:
         # each label is set as a supercategory,
         # the sub-category share its name with supercategory
+        if mode == "category":
+            return [{"supercategory":category, "id": int(id), "name": category}
+                    for id, category in categories.items()]
         return [{"supercategory":category, "id": id+1, "name": category}
-                for id, category in dict(enumerate(a.values())]
+                for id, category in enumerate(categories.values())]
 
-    def _translate_mask(masks, label_dictionary, annotation_dict):
+    def _category_ids(self, label_dictionary, mode = "color"):
         """
-        wrapper extract all the masks information
-        To be finished: how to deal with the 1-1 correspondence between the images and masks?
+        the category ids follow _tidy_categories(), keyed by the packed color,
+        or by the mask value in "category" mode
         """
-        annotation_complete = []
-        for id, mask in enumerate(masks):
-            color_list = self._unique_color(mask)
-            # for any color except [0,0,0], extract the contour and other information
-            sub_masks = [_extract_color(mask, color, label_dictionary, annotation_dict, id+1)
-                         for color in color_list if np.any(c)]
-            annotations.append(sub_masks)
-        # Flatten the 2d array
-        return [annotation for mask_groups in annotation_complete for annotation in mask_groups]
+        if mode == "category":
+            return {int(id): int(id) for id in label_dictionary}
+        return {pack_color(color): id+1
+                for id, color in enumerate(label_dictionary.keys())}
 
-    def _unique_color(self, img):
+    def _translate_mask(self, pairs, label_dictionary, workers = None, rle = False,
+                        tolerance = 0, max_points = None, holes = "fill",
+                        tile_size = None, tile_workers = None, mode = "color", array_cache = None):
         """
-        helper function of _translate_mask(),
-        get all the unique colors in a np.ndarray
+        wrapper extract all the masks information,
+        each mask is decoded, validated, translated and released before the next one
         Args:
-            img: np.ndarray, the image
-        Returns:
-            np.ndarray, an array including all the individual colors
+            pairs: iterable(tuple(image, mask)), from _mask_pairs()
+            label_dictionary: dict, from the color to the category name
+            workers: int, see _to_coco()
+            rle: bool, see _to_coco()
+            tolerance, max_points, holes: the polygon options, see _to_coco()
+            tile_size, tile_workers: the tiled mode options, see _to_coco()
+            mode: str, in "color" or "category", see _to_coco()
+            array_cache: ArrayCache, see _to_coco(), a process pool worker opens it once by its path
+        Return:
+            list[dict]: the "images" field of the coco format
+            list[dict]: the "annotations" field of the coco format
         """
-        return np.unique(img.reshape(-1, img.shape[2]), axis=0)
+        translate = partial(self._translate_pair, category_ids = self._category_ids(label_dictionary, mode), rle = rle,
+                            tolerance = tolerance, max_points = max_points, holes = holes,
+                            tile_size = tile_size, tile_workers = tile_workers, mode = mode,
+                            array_cache = array_cache)
+        if workers is None or workers <= 1:
+            results = map(translate, pairs)
+        else:
+            # executor.map keeps the order of masks, whichever worker finishes first
+            executor = ProcessPoolExecutor(max_workers = workers)
+            results = executor.map(translate, pairs)
+        images = []
+        annotations = []
+        try:
+            # the ids are only given after the extraction,
+            # so the output is exactly the same as a serial run
+            for id, (image, mask_annotations) in enumerate(results):
+                image["id"] = id+1
+                images.append(image)
+                for annotation in mask_annotations:
+                    annotation["image_id"] = id+1
+                    annotation["id"] = len(annotations)+1
+                    annotations.append(annotation)
+        except (AssertionError, KeyError, ValueError, OSError) as e:
+            raise ValidationError(f"There're some data not acceptable as {self.format_name} format: {repr(e)}")
+        finally:
+            if workers is not None and workers > 1:
+                executor.shutdown()
+        return images, annotations
 
-    def _extract_color(mask, color, label_dictionary, annotation_dict, id):
+    def _translate_pair(self, pair, category_ids, rle = False, tolerance = 0, max_points = None, holes = "fill",
+                        tile_size = None, tile_workers = None, mode = "color", array_cache = None):
         """
         helper function of _translate_mask(),
-        extract the information of a specific <color> in <mask> and <label_dictionary>
-        """
-        # extract boolean masks of this specific color as uint8(output for cv2.threshold)
-        sub_mask = np.all(img == color, axis = -1).astype("uint8")
-        # find the contour
-        contours, hierarchy = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        # compute the area and bbox
-        area, bbox = _area_and_bbox(contours[0])
+        decode, validate and translate one (image, mask) pair
+        Return:
+            dict: the "images" field entry, the id is given by _translate_mask()
+            list[dict]: the annotations of this mask
+        """
+        img, mask_path = pair
+        mask = self._read_mask(mask_path, mode, array_cache)
+        # without its image, the mask alone gives the size
+        if img is not None:
+            self._validate_pair(img, mask)
+        if tile_size is not None:
+            annotations = self._extract_labels_tiled(mask, category_ids, tile_size, tile_workers,
+                                                     tolerance = tolerance, max_points = max_points)
+        else:
+            annotations = self._extract_labels(mask, category_ids, rle, tolerance = tolerance,
+                                               max_points = max_points, holes = holes)
+        return self._to_coco_file_manage(img, mask, None, mask_path), annotations
+
+    def _read_mask(self, mask, mode = "color", array_cache = None):
+        """
+        helper function of _translate_pair(),
+        if <mask> is a path, decode it as a RGB (or single channel) np.ndarray,
+        the alpha channel of a RGBA color mask (file or array) is dropped,
+        a .npy file is memory-mapped rather than read, and a mask in <array_cache>
+        is served from its memory map
+        in "category" mode, the mask must be single channel, and a palettized png
+        is read as its indices
+        """
+        cached = self._cached_mask(mask, mode, array_cache)
+        if cached is not None:
+            img = cached
+        elif not isinstance(mask, str):
+            img = np.asarray(mask)
+        elif mask.endswith(".npy"):
+            img = np.load(mask, mmap_mode = "r")
+        elif mode == "category":
+            with Img.open(mask) as image:
+                # only the palettized png needs PIL, cv2 would turn it into colors
+                img = np.asarray(image) if image.mode == "P" else cv2.imread(mask, cv2.IMREAD_UNCHANGED)
+        else:
+            img = self._read_color_mask(mask)
+        if img is None:
+            raise ValueError(f"cannot read mask {mask}")
+        if mode == "category":
+            assert img.ndim == 2, f"a category mask is single channel, not {img.shape}"
+        elif img.ndim == 3 and img.shape[2] == 4:
+            # the color masks are RGB, as the keys of the label dictionary, the alpha is dropped
+            # (a view, so a memory-mapped mask is still not read)
+            img = img[:, :, :3]
+        return img
+
+    def _cached_mask(self, mask, mode, array_cache):
+        """
+        helper function of _read_mask(), the mask of the path <mask> in <array_cache>,
+        None if it's not there, or not decoded the way _read_mask() would
+        """
+        if array_cache is None or not isinstance(mask, str) or array_cache.decode != "unchanged":
+            return None
+        img = array_cache.lookup(mask)
+        # a palettized png was cached as colors, in "category" mode it's read as indices again
+        if img is None or (mode == "category" and img.ndim != 2):
+            return None
+        return img
+
+    def _read_color_mask(self, mask):
+        """
+        helper function of _read_mask(), decode the mask file as RGB, or single channel,
+        the alpha channel of a RGBA png is dropped
+        """
+        img = cv2.imread(mask, cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError(f"cannot read mask {mask}")
+        if img.ndim == 3 and img.shape[2] == 4:
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2RGB)
+        elif img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        return img
+
+    def _extract_labels(self, mask, category_ids, rle = False, tolerance = 0, max_points = None, holes = "fill"):
+        """
+        helper function of _translate_mask(),
+        extract the information of all the colors in <mask> in one pass:
+        the colors are packed into one integer label map, the bounding region of
+        each label is found with one sort, then the contour, area and bbox of each
+        label are computed only inside its own crop rather than the full image
+        Args:
+            mask: np.ndarray, the (height, width, 3) color mask or (height, width) category mask,
+                  or the path of it
+            category_ids: dict{int: int}, the category id of each packed color
+            rle: bool, if True, each label is saved as an iscrowd=1 RLE rather than a polygon
+            tolerance, max_points, holes: the polygon options, see _to_coco()
+        Return:
+            list[dict], the annotations of this mask, image_id and id are given by _translate_mask()
+        """
+        label_map = pack_label_map(self._read_mask(mask))
+        labels, regions = label_regions(label_map)
+        annotations = []
+        for label, region in zip(labels.tolist(), regions):
+            # the background [0,0,0] is not annotated
+            if label == 0:
+                continue
+            assert label in category_ids, f"unknown label {label}"
+            # extract boolean masks of this specific label as uint8(input for cv2.findContours)
+            sub_mask = (label_map[region] == label).astype("uint8")
+            if rle:
+                annotations.append(self._extract_rle(sub_mask, region, label_map.shape, category_ids[label]))
+                continue
+            annotations.append(self._extract_polygons(sub_mask, region, label_map.shape, category_ids[label],
+                                                      tolerance, max_points, holes))
+        return annotations
+
+    def _extract_polygons(self, sub_mask, region, size, category_id, tolerance, max_points, holes):
+        """
+        helper function of _extract_labels(),
+        trace all the components of a label into polygons, simplified within the budget
+        Args:
+            sub_mask: np.ndarray, the binary mask of the label, cropped to <region>
+            region: tuple(slice, slice), the (row, column) slices of the crop
+            size: tuple(int, int), the (height, width) of the complete mask
+            category_id: int, the category id of the label
+            tolerance, max_points, holes: the polygon options, see _to_coco()
+        Return:
+            dict, the annotation
+        """
+        # find the outer contours, offset them back to the coordinate of the full mask,
+        # the holes are only looked for when they're going to be kept
+        retrieval = cv2.RETR_CCOMP if holes == "rle" else cv2.RETR_EXTERNAL
+        contours, hierarchy = cv2.findContours(sub_mask, retrieval, cv2.CHAIN_APPROX_SIMPLE,
+                                               offset = (region[1].start, region[0].start))
+        if holes == "rle":
+            # in RETR_CCOMP, the holes are the contours with a parent
+            if (hierarchy[0, :, 3] >= 0).any():
+                return self._extract_rle(sub_mask, region, size, category_id)
+        contours = self._simplify_contours(contours, tolerance, max_points)
+        # compute the area of all the components in one go
+        points, offsets = coco_contours_to_buffer(contours, dtype = np.float32)
+        areas, _ = polygon_area_and_bbox(points, offsets)
+        # the region is already the tight bounding box
+        bbox = (region[1].start, region[0].start,
+                region[1].stop - region[1].start, region[0].stop - region[0].start)
         return {"bbox": bbox,
-                "category_id": label_dictionary[color],
-                "segmentation": contours[0].flatten(),
-                "image_id": annotation_dict[id], # To be finished
+                "category_id": category_id,
+                "segmentation": [contour.flatten() for contour in contours],
                 "iscrowd":0,
-                "area": area}
+                "area": float(areas.sum())}
+
+    def _simplify_contours(self, contours, tolerance = 0, max_points = None):
+        """
+        helper function of _extract_polygons(),
+        simplify the contours by cv2.approxPolyDP, and fit them in the point budget
+        Args:
+            contours: list[np.ndarray], the cv2 contours in (n_point, 1, 2) shape
+            tolerance: float, the tolerance of cv2.approxPolyDP in pixel, 0 for not simplified
+            max_points: int, the number of points of all the contours at most, None for no limit
+        Return:
+            list[np.ndarray], the simplified contours
+        """
+        def simplify(epsilon):
+            simplified = [cv2.approxPolyDP(contour, epsilon, True) if epsilon > 0 else contour
+                          for contour in contours]
+            # less than 3 points is a dot or a line rather than a polygon,
+            # they are dropped, unless there's nothing else
+            polygons = [contour for contour in simplified if len(contour) >= 3]
+            return polygons or [max(simplified, key = len)]
+
+        polygons = simplify(tolerance)
+        if max_points is None:
+            return polygons
+        # double the tolerance until the points fit in the budget, or until
+        # the tolerance is as large as the contours, which can't get simpler
+        epsilon = max(tolerance, 0.5)
+        extent = max(np.ptp(contour.reshape(-1, 2), axis = 0).max() for contour in contours)
+        while sum(len(polygon) for polygon in polygons) > max_points and epsilon < extent:
+            epsilon *= 2
+            polygons = simplify(epsilon)
+        if sum(len(polygon) for polygon in polygons) <= max_points:
+            return polygons
+        # still too many components, keep the largest ones fitting in the budget, in their order
+        order = sorted(range(len(polygons)), key = lambda i: -cv2.contourArea(polygons[i]))
+        kept = set()
+        budget = max_points
+        for i in order:
+            if len(polygons[i]) <= budget or not kept:
+                kept.add(i)
+                budget -= len(polygons[i])
+        return [polygon for i, polygon in enumerate(polygons) if i in kept]
+
+    def _extract_labels_tiled(self, mask, category_ids, tile_size, tile_workers = None,
+                              tolerance = 0, max_points = None, stitch_limit = None):
+        """
+        helper function of _translate_mask(), the tiled version of _extract_labels()
+        for the masks too large to be held in the memory (e.g. a np.memmap or a .npy file):
+        the mask is read tile by tile, the components of each label are traced in each tile,
+        and the components crossing the tile borders are linked by the 1-pixel strips along
+        the borders of the neighbouring tiles. A linked component is traced again as one outline,
+        whatever its size: from a window of its bounding box if the box is at most <stitch_limit>
+        pixels, otherwise by following its border across the tiles, see _follow_border(),
+        which only reads the tiles along the border. The components inside the holes of
+        a linked component are dropped, as cv2.RETR_EXTERNAL does, and the contours are in the
+        order of cv2, so the annotations are the same as _extract_labels() with holes="fill".
+        Only a row of tiles is in the memory at a time during the linking.
+        Args:
+            mask: np.ndarray, the (height, width, 3) color mask or (height, width) category mask,
+                  a np.memmap is only read window by window
+            category_ids: dict{int: int}, the category id of each packed color
+            tile_size: int, the height and width of the tiles
+            tile_workers: int, the number of threads tracing the tiles of a row, None or 1
+                          run in this thread
+            tolerance, max_points: the polygon options, see _to_coco()
+            stitch_limit: int, the bounding box area of a linked component traced again from
+                          a window at most, 4 tiles by default, the larger ones are followed
+        Return:
+            list[dict], the annotations of this mask, one for each label,
+            image_id and id are given by _translate_mask()
+        """
+        height, width = mask.shape[:2]
+        stitch_limit = stitch_limit or 4 * tile_size * tile_size
+        # all the pieces traced, [label, contour, (x_min, y_min, x_max, y_max)], id is index+1
+        pieces = []
+        # the union-find of the pieces linked across the borders
+        parent = {}
+
+        def find(id):
+            while parent.get(id, id) != id:
+                parent[id] = parent.get(parent[id], parent[id])
+                id = parent[id]
+            return id
+
+        def link(strip_a, strip_b):
+            # 8-connectivity: each pixel touches the 3 pixels facing it in the other strip
+            for shift in (-1, 0, 1):
+                a = strip_a[max(shift, 0): len(strip_a) + min(shift, 0)]
+                b = strip_b[max(-shift, 0): len(strip_b) + min(-shift, 0)]
+                touching = (a > 0) & (b > 0)
+                if not touching.any():
+                    continue
+                for id_a, id_b in np.unique(np.stack([a[touching], b[touching]], axis = 1), axis = 0).tolist():
+                    if pieces[id_a-1][0] == pieces[id_b-1][0]:
+                        root_a, root_b = find(id_a), find(id_b)
+                        if root_a != root_b:
+                            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+        trace = partial(self._trace_tile, mask, tile_size, category_ids)
+        executor = ThreadPoolExecutor(max_workers = tile_workers) \
+                   if tile_workers is not None and tile_workers > 1 else None
+        try:
+            previous_bottom = None
+            for y in range(0, height, tile_size):
+                origins = [(x, y) for x in range(0, width, tile_size)]
+                results = executor.map(trace, origins) if executor is not None else map(trace, origins)
+                tops, bottoms = [], []
+                previous_right = None
+                for tile_pieces, (top, bottom, left, right) in results:
+                    # the local ids of this tile are moved after all the pieces before
+                    offset = len(pieces)
+                    pieces += tile_pieces
+                    top, bottom, left, right = [np.where(strip > 0, strip + offset, 0)
+                                                for strip in (top, bottom, left, right)]
+                    if previous_right is not None:
+                        link(previous_right, left)
+                    previous_right = right
+                    tops.append(top)
+                    bottoms.append(bottom)
+                # the border with the row above is linked as a whole, so the corners are linked too
+                if previous_bottom is not None:
+                    link(previous_bottom, np.concatenate(tops))
+                previous_bottom = np.concatenate(bottoms)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        # group the pieces into the components, and the components into the labels
+        groups = defaultdict(list)
+        for id in range(1, len(pieces)+1):
+            groups[find(id)].append(pieces[id-1])
+        label_contours = defaultdict(list)
+        label_boxes = defaultdict(list)
+        # the linked components, which may enclose the components of other tiles in their holes
+        label_linked = defaultdict(list)
+        for group in groups.values():
+            label = group[0][0]
+            x_min = min(piece[2][0] for piece in group)
+            y_min = min(piece[2][1] for piece in group)
+            x_max = max(piece[2][2] for piece in group)
+            y_max = max(piece[2][3] for piece in group)
+            label_boxes[label].append((x_min, y_min, x_max, y_max))
+            if len(group) == 1:
+                label_contours[label].append(group[0][1])
+                continue
+            if (x_max-x_min+1) * (y_max-y_min+1) <= stitch_limit:
+                # trace the component again in the window of its bounding box
+                window = (pack_label_map(np.asarray(mask[y_min:y_max+1, x_min:x_max+1])) == label).astype("uint8")
+                _, components = cv2.connectedComponents(window, connectivity = 8)
+                # any point of a piece is a pixel of the component
+                seed_x, seed_y = group[0][1][0, 0]
+                component = (components == components[seed_y-y_min, seed_x-x_min]).astype("uint8")
+                contours, _ = cv2.findContours(component, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                               offset = (x_min, y_min))
+                outline = max(contours, key = len)
+            else:
+                # the first pixel in the raster order, the leftmost of the top row, is on the border
+                start = min((int(point[1]), int(point[0])) for piece in group for point in piece[1][:, 0])
+                outline = self._follow_border(mask, label, start, tile_size)
+            label_contours[label].append(outline)
+            label_linked[label].append((outline, (x_min, y_min, x_max, y_max)))
+
+        for label, linked in label_linked.items():
+            label_contours[label], label_boxes[label] = self._drop_enclosed(label_contours[label],
+                                                                             label_boxes[label], linked)
+
+        annotations = []
+        for label in sorted(label_contours):
+            # in the order of cv2.findContours on the complete mask: the last one found first,
+            # every contour starts at the first pixel of its component in the raster order
+            contours = sorted(label_contours[label], key = lambda contour: (int(contour[0, 0, 1]), int(contour[0, 0, 0])),
+                              reverse = True)
+            contours = self._simplify_contours(contours, tolerance, max_points)
+            points, offsets = coco_contours_to_buffer(contours, dtype = np.float32)
+            areas, _ = polygon_area_and_bbox(points, offsets)
+            boxes = np.array(label_boxes[label])
+            x_min, y_min = boxes[:, :2].min(axis = 0).tolist()
+            x_max, y_max = boxes[:, 2:].max(axis = 0).tolist()
+            annotations.append({"bbox": (x_min, y_min, x_max-x_min+1, y_max-y_min+1),
+                                "category_id": category_ids[label],
+                                "segmentation": [contour.flatten() for contour in contours],
+                                "iscrowd":0,
+                                "area": float(areas.sum())})
+        return annotations
+
+    def _drop_enclosed(self, contours, boxes, linked):
+        """
+        helper function of _extract_labels_tiled(), drop the components of a label lying
+        in the holes of a linked component of the same label, as cv2.RETR_EXTERNAL does,
+        a component inside one tile is never enclosed by another of the same tile here,
+        _trace_tile() already dropped it
+        Args:
+            contours: list[np.ndarray], the outlines of the components of the label
+            boxes: list[tuple], their (x_min, y_min, x_max, y_max)
+            linked: list[tuple(np.ndarray, tuple)], the outlines and boxes of the linked components
+        Return:
+            the contours and the boxes kept
+        """
+        box_array = np.array(boxes)
+        enclosed = np.zeros(len(contours), dtype = bool)
+        for outline, (x_min, y_min, x_max, y_max) in linked:
+            # only the components strictly inside the box may be inside the outline
+            inside = np.flatnonzero((box_array[:, 0] > x_min) & (box_array[:, 1] > y_min) &
+                                    (box_array[:, 2] < x_max) & (box_array[:, 3] < y_max) & ~enclosed)
+            for index in inside.tolist():
+                # the components are disjoint, so the first point is either inside or outside
+                point = tuple(float(value) for value in contours[index][0, 0])
+                if cv2.pointPolygonTest(outline, point, False) > 0:
+                    enclosed[index] = True
+        return ([contour for contour, drop in zip(contours, enclosed) if not drop],
+                [box for box, drop in zip(boxes, enclosed) if not drop])
+
+    def _follow_border(self, mask, label, start, tile_size, cached_tiles = 16):
+        """
+        helper function of _extract_labels_tiled(), trace the outer border of the component
+        of <label> starting from <start> by the border following of Suzuki and Abe (1985),
+        the same as cv2.findContours(cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE), pixel by pixel,
+        so a component of any size is traced reading only the tiles along its border
+        Args:
+            mask: np.ndarray, the complete mask, only the tiles on the border are read
+            label: int, the packed label of the component
+            start: tuple(int, int), the (y, x) of the first pixel of the component in the raster order
+            tile_size: int, the height and width of the tiles read
+            cached_tiles: int, the number of tiles kept in the memory at most
+        Return:
+            np.ndarray, the contour in cv2 (n_point, 1, 2) shape
+        """
+        height, width = mask.shape[:2]
+        tiles = OrderedDict()
+
+        def inside(y, x):
+            if y < 0 or x < 0 or y >= height or x >= width:
+                return False
+            key = (y // tile_size, x // tile_size)
+            tile = tiles.get(key)
+            if tile is None:
+                top, left = key[0] * tile_size, key[1] * tile_size
+                tile = pack_label_map(np.asarray(mask[top:top+tile_size, left:left+tile_size])) == label
+                tiles[key] = tile
+                if len(tiles) > cached_tiles:
+                    tiles.popitem(last = False)
+            else:
+                tiles.move_to_end(key)
+            return tile[y % tile_size, x % tile_size]
+
+        # the 8 neighbours counterclockwise from the east, in (dy, dx)
+        directions = ((0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1), (1, 0), (1, 1))
+        y, x = start
+        # the first neighbour clockwise from the west, which is the background
+        first = None
+        for step in range(8):
+            dy, dx = directions[(4 - step) % 8]
+            if inside(y + dy, x + dx):
+                first = (y + dy, x + dx)
+                break
+        if first is None:
+            return np.array([[[x, y]]], dtype = np.int32)
+        previous, current = first, (y, x)
+        points = []
+        while True:
+            # the next pixel counterclockwise from the previous one around the current one
+            direction = directions.index((previous[0] - current[0], previous[1] - current[1]))
+            for step in range(1, 9):
+                dy, dx = directions[(direction + step) % 8]
+                following = (current[0] + dy, current[1] + dx)
+                if inside(*following):
+                    break
+            points.append((current[1], current[0]))
+            if following == (y, x) and current == first:
+                break
+            previous, current = current, following
+        points = np.array(points, dtype = np.int32)
+        if len(points) >= 3:
+            # cv2.CHAIN_APPROX_SIMPLE: only the points where the direction changes are kept
+            before = points - np.roll(points, 1, axis = 0)
+            after = np.roll(points, -1, axis = 0) - points
+            points = points[(before != after).any(axis = 1)]
+        return points[:, None, :]
+
+    def _trace_tile(self, mask, tile_size, category_ids, origin):
+        """
+        helper function of _extract_labels_tiled(), trace the components in one tile
+        Args:
+            mask: np.ndarray, the complete mask, only the tile is read
+            tile_size: int, the height and width of the tiles
+            category_ids: dict{int: int}, the category id of each packed color
+            origin: tuple(int, int), the (x, y) of the top-left pixel of the tile
+        Return:
+            pieces: list[list], [label, contour, (x_min, y_min, x_max, y_max)] of each component,
+                    in the coordinate of the complete mask
+            strips: tuple(np.ndarray), the piece id (index+1, 0 for none) of the pixels
+                    on the top, bottom, left and right border of the tile
+        """
+        x, y = origin
+        tile = pack_label_map(np.asarray(mask[y:y+tile_size, x:x+tile_size]))
+        ids = np.zeros(tile.shape, dtype = np.int64)
+        pieces = []
+        labels, regions = label_regions(tile)
+        for label, region in zip(labels.tolist(), regions):
+            # the background [0,0,0] is not annotated
+            if label == 0:
+                continue
+            assert label in category_ids, f"unknown label {label}"
+            sub_mask = (tile[region] == label).astype("uint8")
+            n_components, components = cv2.connectedComponents(sub_mask, connectivity = 8)
+            offset = (x + region[1].start, y + region[0].start)
+            contours, _ = cv2.findContours(sub_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE,
+                                           offset = offset)
+            # the pieces are the components with an outer contour, the ones inside the holes
+            # of another component are filled with it and not traced
+            lookup = np.zeros(n_components, dtype = np.int64)
+            for contour in contours:
+                left, top, w, h = cv2.boundingRect(contour)
+                pieces.append([label, contour, (left, top, left+w-1, top+h-1)])
+                point_x, point_y = contour[0, 0]
+                lookup[components[point_y-offset[1], point_x-offset[0]]] = len(pieces)
+            lookup[0] = 0
+            ids[region] = np.where(sub_mask > 0, lookup[components], ids[region])
+        return pieces, (ids[0], ids[-1], ids[:, 0], ids[:, -1])
+
+    def _extract_rle(self, sub_mask, region, size, category_id):
+        """
+        helper function of _extract_labels(),
+        encode a label as a compressed RLE, only its crop <sub_mask> is scanned
+        Args:
+            sub_mask: np.ndarray, the binary mask of the label, cropped to <region>
+            region: tuple(slice, slice), the (row, column) slices of the crop
+            size: tuple(int, int), the (height, width) of the complete mask
+            category_id: int, the category id of the label
+        Return:
+            dict, the annotation
+        """
+        rle = rle_encode(sub_mask, size = size, offset = (region[1].start, region[0].start))
+        rle["counts"] = rle_to_string(rle["counts"])
+        # the region is already the tight bounding box
+        bbox = (region[1].start, region[0].start,
+                region[1].stop - region[1].start, region[0].stop - region[0].start)
+        return {"bbox": bbox,
+                "category_id": category_id,
+                "segmentation": rle,
+                "iscrowd":1,
+                "area": float(np.count_nonzero(sub_mask))}
 #-------------------------The following is interpreting coco to mask------------------
-    def _from_coco(self, dst, coco_data, mode = "color", palette = "viridis"):
+    def _from_coco(self, dst, coco_data, mode = "color", palette = "viridis", palettized = False,
+                   workers = None, writers = None, queue_depth = None, incremental = False):
         """
         translate the COCO format data to mask format
+        the category of each pixel is drawn on a single channel canvas first, then in color mode
+        it's colorized by one lookup in the palette table, rather than drawing 3 channels
         Args:
             dst: str, the path output, from memory consideration
                  each individual output will be saved after created
                  rather than saved in the memory
-            coco_data: json instance, the complete coco format
+            coco_data: json instance or CocoStream, the complete coco format
             mode: str, in "color" or "category", when outputting the mask, returning
                   3-channel colors, or 1-channel category id representing the color
             palette: str, the palette in seaborn, "viridis" by default
+            palettized: bool, in color mode, if True, the masks are saved as palettized png,
+                        1 channel of indices plus the palette, smaller and faster to write,
+                        and read as the same colors. Only up to 255 categories
+            workers: int, the number of threads drawing the masks
+            writers: int, the number of threads encoding and writing the png files,
+                     when both workers and writers are None, everything runs in this thread
+            queue_depth: int, the number of masks drawn but not written yet at most,
+                         it bounds the memory, 2 * (workers + writers) by default
+            incremental: bool, if True, the masks whose image and annotations are unchanged
+                         since the last run are not drawn again, and a crashed run resumes,
+                         see base._Manifest
         """
         # check if dst is there, if not create one
         os.makedirs(dst, exist_ok = True)
         # distribute a color for all the categories
-        categories = self._extract_categories(coco_data["categories"],
-                                              mode = "color",
-                                              palette = "viridis")
+        categories = self._extract_categories(self._coco_categories(coco_data),
+                                              mode = mode,
+                                              palette = palette)
+        # the values drawn on the canvas, and the palette table from the value to the color
+        lut = self._palette_lut(categories) if mode == "color" else None
+        max_value = max([category["index"] for category in categories.values()], default = 0)
+        assert max_value < 1 << 16, f"the category id {max_value} doesn't fit in a 16-bit mask"
+        dtype = np.uint8 if max_value < 1 << 8 else np.uint16
+        palettized = palettized and mode == "color" and max_value < 1 << 8
+        # the palettized png is written by PIL, in RGB
+        png_palette = lut[:, ::-1].tobytes() if palettized else None
+
+        def rasterize(image, annotations, canvas_pool):
+            canvas = self._rasterize(image, annotations, categories, dtype, canvas_pool)
+            if lut is None or palettized:
+                return canvas
+            # colorize in one lookup, into a canvas from the pool as well
+            colored = self._colorize(canvas, lut, canvas_pool.get(canvas.shape + (3,)))
+            canvas_pool.put(canvas)
+            return colored
+
         path_dict = {}
-        # for each image
-        for image in coco_data["images"]:
-            # create a blank canvas at the same size as canvas
-            if mode == "color":
-                canvas = np.zeros(image["height"], image["width"], 3)
-            else:
-                canvas = np.zeros(image["height"], image["width"])
-            # filter all the annotation which belongs to this image
-            annotations = [annotation in coco_data["annotations"] if annotation["image_id"] = image["id"]]
-            for annotation in annotations:
-                # for each annotation, draw it on the canvas
-                canvas = self._extract_contour(canvas = canvas,
-                                               segmentation = annotation["segmentation"],
-                                               color = categories[annotation["category_id"]]["color"])
-
-            file_name = self._output_file_name(dst, image)
-            # write the image out -- it's for consideration on memory and just in case the
-            # dataset might be extremely large
-            cv2.imwrite(os.path.join(dst, file_name), canvas)
-            # save the file name, with the image_id as the key
-            path_dict[image["id"]] = file_name
-            # clear the memory(it cleans the memory leak LAST LOOP, but it's okay)
-            gc.collect()
+        # the categories and the options change all the masks, they're part of the hashes
+        manifest_options = [self.format_name, mode, palette, palettized, coco_data["categories"]]
+        with _Manifest(dst, manifest_options, enabled = incremental) as manifest:
+            if workers is None and writers is None:
+                # only one canvas of each size is needed
+                canvas_pool = _CanvasPool(size = 1)
+                # for each image
+                for image, annotations in self._coco_groups(coco_data):
+                    file_name = self._output_file_name(dst, image)
+                    # save the file name, with the image_id as the key
+                    path_dict[image["id"]] = file_name
+                    digest = manifest.changed(image, annotations, file_name)
+                    if digest is None:
+                        continue
+                    canvas = rasterize(image, annotations, canvas_pool)
+                    # write the image out -- it's for consideration on memory and just in case the
+                    # dataset might be extremely large
+                    self._write_mask(os.path.join(dst, file_name), canvas, png_palette)
+                    canvas_pool.put(canvas)
+                    manifest.record(image["id"], digest, file_name)
+                return (dst, path_dict)
+
+            # cv2 releases the GIL when drawing and encoding, so threads are enough here,
+            # and the canvases are never copied between processes
+            workers = workers or 1
+            writers = writers or 1
+            queue_depth = queue_depth or 2 * (workers + writers)
+            # the canvases already written are put back here to be reused,
+            # there're never more than queue_depth canvases in use
+            canvas_pool = _CanvasPool(size = queue_depth)
+            slots = threading.BoundedSemaphore(queue_depth)
+
+            def write(image, file_name, digest, canvas):
+                try:
+                    self._write_mask(os.path.join(dst, file_name), canvas, png_palette)
+                    manifest.record(image["id"], digest, file_name)
+                finally:
+                    canvas_pool.put(canvas)
+                    slots.release()
+
+            def draw(image, annotations, file_name, digest):
+                try:
+                    canvas = rasterize(image, annotations, canvas_pool)
+                except BaseException:
+                    slots.release()
+                    raise
+                return write_pool.submit(write, image, file_name, digest, canvas)
+
+            drawn = []
+            with ThreadPoolExecutor(max_workers = writers) as write_pool, \
+                 ThreadPoolExecutor(max_workers = workers) as draw_pool:
+                for image, annotations in self._coco_groups(coco_data):
+                    file_name = self._output_file_name(dst, image)
+                    path_dict[image["id"]] = file_name
+                    digest = manifest.changed(image, annotations, file_name)
+                    if digest is None:
+                        continue
+                    # wait until there's a free slot in the queue
+                    slots.acquire()
+                    drawn.append(draw_pool.submit(draw, image, annotations, file_name, digest))
+            # raise the error in drawing or writing, if there's any
+            for future in drawn:
+                future.result().result()
         return (dst, path_dict)
 
+    def _rasterize(self, image, annotations, categories, dtype, canvas_pool):
+        """
+        helper function of _from_coco(), draw the index of the category of all the
+        <annotations> of <image> on a single channel canvas
+        Args:
+            image: dict, the image in the coco format
+            annotations: list[dict], the annotations of this image
+            categories: dict, the output of _extract_categories()
+            dtype: np.uint8 or np.uint16, the dtype of the canvas, fitting all the indices
+            canvas_pool: _CanvasPool, where the canvas is taken from
+        return:
+            np.ndarray, the painted canvas
+        """
+        # a blank canvas at the same size as the image
+        canvas = canvas_pool.get((image["height"], image["width"]), dtype)
+        # all the annotation which belongs to this image
+        for annotation in annotations:
+            index = categories[annotation["category_id"]]["index"]
+            # the RLE is decoded and painted directly, rather than traced into polygons
+            if isinstance(annotation["segmentation"], dict):
+                canvas = self._extract_rle_mask(canvas = canvas,
+                                                rle = annotation["segmentation"],
+                                                color = index)
+                continue
+            # for each annotation, draw it on the canvas
+            canvas = self._extract_contour(canvas = canvas,
+                                           segmentation = annotation["segmentation"],
+                                           color = index)
+        return canvas
+
+    def _palette_lut(self, categories):
+        """
+        helper function of _from_coco(), the lookup table from the index drawn to the color
+        Args:
+            categories: dict, the output of _extract_categories() in color mode
+        return:
+            np.ndarray, in (max index + 1, 3) shape, the uint8 colors in BGR as cv2 writes,
+            the index 0 is the black background
+        """
+        lut = np.zeros((max([category["index"] for category in categories.values()], default = 0)+1, 3),
+                       dtype = np.uint8)
+        for category in categories.values():
+            # rounded as cv2.drawContours does
+            lut[category["index"]] = np.rint(category["color"])[::-1]
+        return lut
+
+    def _colorize(self, canvas, lut, colored):
+        """
+        helper function of _from_coco(), colorize the indices on <canvas> by the table <lut>,
+        it's colored[i, j] = lut[canvas[i, j]] but faster
+        Args:
+            canvas: np.ndarray, the (height, width) uint8 or uint16 indices
+            lut: np.ndarray, the (n, 3) uint8 colors, from _palette_lut()
+            colored: np.ndarray, the (height, width, 3) uint8 output
+        return:
+            np.ndarray, <colored>
+        """
+        if canvas.dtype != np.uint8:
+            return np.take(lut, canvas, axis = 0, out = colored)
+        # a 8-bit canvas goes through cv2.LUT channel by channel, 3 times faster than np.take
+        channels = np.zeros((3, 256), dtype = np.uint8)
+        channels[:, :len(lut)] = lut.T
+        return cv2.merge([cv2.LUT(canvas, channel) for channel in channels], colored)
+
+    def _write_mask(self, path, canvas, png_palette = None):
+        """
+        helper function of _from_coco(), write a mask out
+        Args:
+            path: str, the output path
+            canvas: np.ndarray, the mask, in BGR if it's in 3 channels
+            png_palette: bytes, if given, <canvas> is the indices and it's saved as a palettized png
+        """
+        if png_palette is None:
+            cv2.imwrite(path, canvas)
+            return
+        # cv2 doesn't write palettized png, PIL does
+        image = Img.fromarray(canvas)
+        # an "L" image with a palette becomes a "P" image
+        image.putpalette(png_palette)
+        # the same compression level as cv2.imwrite by default
+        image.save(path, format = "PNG", compress_level = 1)
+
     def _output_file_name(self, dst, image):
         """
         generate a output file name
         """
-        output_path = f'{image["id"]}_{image["file_name"]}_mask.png'
+        return f'{image["id"]}_{image["file_name"]}_mask.png'
 
     def _extract_categories(self, coco_category, mode = "color", palette = "viridis"):
         """
@@ -211,27 +1049,30 @@ class MaskInterpreter(_Translater):
         then assign each category a color
 
         Args:
-            coco_category: json/dict instance, the category data
+            coco_category: dict{int: dict}, the categories by id, from _coco_categories()
             mode: str, in "color" or "category", when outputting the mask, returning
                   3-channel colors, or 1-channel category id representing the color
             palette: str, the palette in seaborn, "viridis" by default
         Return:
-            color_dict: dict, the dict with their corresponding color and detailed information
+            color_dict: dict, the dict with their corresponding color and detailed information,
+                        and the index drawn on the canvas: in color mode the order of the
+                        category from 1, in category mode the category id
         """
         assert mode in ["color", "category"]
-        if mode == "color"
+        if mode == "color":
             # in color mode, choose a sns palette
             custom_palette = sns.color_palette(palette, len(coco_category))
             # convert it to traditional RGB
             np_palette = np.array(custom_palette)*255
-            # give each individual category a color
-            coco_category = {category["id"]:{"details":category, "color":np_palette[category["id"]-1]}
-                             for category in coco_category}
+            # give each individual category a color, in the order of the categories,
+            # so the ids don't need to be 1 to n
+            coco_category = {id:{"details":category, "color":np_palette[index], "index":index+1}
+                             for index, (id, category) in enumerate(coco_category.items())}
         else:
             # give each individual category its id as mask
             # give each individual category a color
-            coco_category = {category["id"]:{"details":category, "color":category["id"]}
-                             for category in coco_category}
+            coco_category = {id:{"details":category, "color":id, "index":id}
+                             for id, category in coco_category.items()}
         return coco_category
 
     def _extract_contour(self, canvas, segmentation, color):
@@ -242,14 +1083,30 @@ class MaskInterpreter(_Translater):
                     the canvas to be painted on, usually a output from np.zeros
             contour: list[np.ndarray], in (n_point, 1, 2) shape,
                     the contour to be drawed on
-            color: iterable with 3 channels, the color to be drawed
+            color: int or iterable with 3 channels, the color (or the index) to be drawed
         return:
             painted_canvas: np.ndarray, the canvas to be drawed on
         """
         # interpret all the segmentation into cv2
         # this dtype = np.int32 is necessary for running, although it will loss precisions
+        # a int32 np.ndarray (e.g. from to_coco) is not copied, reshape only gives a view
         segmentation = [coco_contour_to_cv2(contour, dtype = np.int32) for contour in segmentation]
         # for the contour, draw contour on canvas,
         # the first -1 is for draw all contours in the list
         # the last list is for filling the contour
         painted_canvas = cv2.drawContours(canvas, segmentation, -1, color, -1)
+        return painted_canvas
+
+    def _extract_rle_mask(self, canvas, rle, color):
+        """
+        given a COCO <rle> and a <canvas>, add a mask with <color> on <canvas>
+        Args:
+            canvas: np.ndarray, in (height,width,3) shape or (height,width)
+            rle: dict, the COCO RLE, compressed or not
+            color: int or iterable with 3 channels, the color (or the index) to be drawed
+        return:
+            painted_canvas: np.ndarray, the canvas to be drawed on
+        """
+        # rounded as cv2.drawContours does
+        canvas[rle_decode(rle).astype(bool)] = np.rint(color)
+        return canvas
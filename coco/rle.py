@@ -0,0 +1,164 @@
+"""
+run-length encoding (RLE) of binary masks, in the same format as COCO (pycocotools):
+the mask is read in column-major (Fortran) order, "counts" starts with the number of 0,
+then the number of 1, then the number of 0... alternately,
+a compressed RLE saves the counts in a string rather than a list
+"""
+import numpy as np
+import cv2
+
+def rle_encode(binary_mask, size = None, offset = (0, 0)):
+    """
+    encode a binary mask into an uncompressed COCO RLE
+    the mask can be a crop of a larger image, only the crop is scanned
+    args:
+        binary_mask: np.ndarray, in (height, width) shape, non-zero pixels are the foreground
+        size: tuple(int, int), the (height, width) of the complete image,
+              the shape of <binary_mask> by default
+        offset: tuple(int, int), the (x, y) of the top-left pixel of <binary_mask>
+                in the complete image
+    return:
+        dict, {"size": [height, width], "counts": list[int]}
+    """
+    mask = np.asarray(binary_mask).astype(bool)
+    h, w = mask.shape
+    height, width = size if size is not None else (h, w)
+    x, y = offset
+    # pad each column with a 0 at both ends, so no run goes across two columns
+    padded = np.zeros((h+2, w), dtype = np.int8)
+    padded[1:-1] = mask
+    change = np.diff(padded.ravel(order = "F"))
+    # the first pixel of each run of 1, and the first pixel after it
+    starts = np.flatnonzero(change == 1) + 1
+    ends = np.flatnonzero(change == -1) + 1
+    # back to the index in the complete image
+    starts = (x + starts // (h+2)) * height + y + starts % (h+2) - 1
+    ends = (x + ends // (h+2)) * height + y + ends % (h+2) - 1
+    # the runs ending at the bottom of a column may continue on the top of the next one
+    if len(starts) > 1:
+        separated = starts[1:] != ends[:-1]
+        starts = starts[np.concatenate(([True], separated))]
+        ends = ends[np.concatenate((separated, [True]))]
+    bounds = np.empty(2*len(starts)+2, dtype = np.int64)
+    bounds[0] = 0
+    bounds[1:-1:2] = starts
+    bounds[2:-1:2] = ends
+    bounds[-1] = height * width
+    counts = np.diff(bounds)
+    # no tailing 0 when the mask ends with a run of 1, the same as pycocotools
+    if len(counts) > 1 and counts[-1] == 0:
+        counts = counts[:-1]
+    return {"size": [int(height), int(width)], "counts": counts.tolist()}
+
+def rle_decode(rle):
+    """
+    decode a COCO RLE (compressed or not) into a binary mask
+    args:
+        rle: dict, {"size": [height, width], "counts": list[int] or str}
+    return:
+        np.ndarray, the (height, width) uint8 mask, 1 for the foreground
+    """
+    height, width = rle["size"]
+    counts = rle["counts"]
+    if isinstance(counts, (str, bytes)):
+        counts = rle_from_string(counts)
+    counts = np.asarray(counts, dtype = np.int64)
+    values = np.zeros(len(counts), dtype = np.uint8)
+    values[1::2] = 1
+    return np.repeat(values, counts).reshape(width, height).T
+
+def rle_to_string(counts):
+    """
+    compress the RLE counts into the COCO string, the same as rleToString in pycocotools:
+    after the third count, each count is saved as the difference to the count two before,
+    then written 5 bits per character, the 6th bit marks there're more characters
+    args:
+        counts: list[int], the uncompressed counts
+    return:
+        str, the compressed counts
+    """
+    output = []
+    for i, x in enumerate(counts):
+        x = int(x)
+        if i > 2:
+            x -= int(counts[i-2])
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            output.append(chr(c + 48))
+    return "".join(output)
+
+def rle_from_string(string):
+    """
+    decompress the COCO string into the RLE counts, the reverse of rle_to_string()
+    args:
+        string: str or bytes, the compressed counts
+    return:
+        list[int], the uncompressed counts
+    """
+    if isinstance(string, bytes):
+        string = string.decode("ascii")
+    counts = []
+    p = 0
+    while p < len(string):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(string[p]) - 48
+            x |= (c & 0x1f) << 5 * k
+            more = c & 0x20
+            p += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << 5 * k
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return counts
+
+def rle_area_and_bbox(rle):
+    """
+    compute the area and the bounding box of a COCO RLE without decoding it
+    args:
+        rle: dict, {"size": [height, width], "counts": list[int] or str}
+    return:
+        area: int, the number of foreground pixels
+        bbox: list[int], the [x,y,w,h] bounding box, the same as pycocotools toBbox
+    """
+    height = rle["size"][0]
+    counts = rle["counts"]
+    if isinstance(counts, (str, bytes)):
+        counts = rle_from_string(counts)
+    bounds = np.cumsum(np.asarray(counts, dtype = np.int64))
+    # the foreground runs are [bounds[0], bounds[1]), [bounds[2], bounds[3])...
+    starts, ends = bounds[0:-1:2], bounds[1::2]
+    filled = ends > starts
+    starts, ends = starts[filled], ends[filled] - 1
+    if len(starts) == 0:
+        return 0, [0, 0, 0, 0]
+    area = int((ends - starts + 1).sum())
+    x_start, x_end = starts // height, ends // height
+    # a run going across columns covers the whole height
+    if (x_start != x_end).any():
+        y_min, y_max = 0, height - 1
+    else:
+        y_min, y_max = int((starts % height).min()), int((ends % height).max())
+    x_min, x_max = int(x_start.min()), int(x_end.max())
+    return area, [x_min, y_min, x_max - x_min + 1, y_max - y_min + 1]
+
+def rle_to_polygons(rle):
+    """
+    trace the outer contours of a COCO RLE, for the formats only taking polygons
+    args:
+        rle: dict, {"size": [height, width], "counts": list[int] or str}
+    return:
+        list[list[int]], the coco format contours [[x_1,y_1,x_2,y_2,...], ...]
+    """
+    mask = np.ascontiguousarray(rle_decode(rle))
+    contours, hierarchy = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return [contour.flatten().tolist() for contour in contours]
@@ -0,0 +1,158 @@
+"""
+write the COCO outputs in shards of N images, and merge the shards back into one file,
+so a large dataset can be converted on many machines and combined cheaply.
+Each shard reserves its own id ranges: the images of shard k are numbered from
+k * images_per_shard + 1 and its annotations from k * annotations_per_shard + 1,
+so the ids are globally unique without any communication between the writers
+"""
+from collections import defaultdict
+from . import jsonio
+import shutil
+import tempfile
+import os
+
+class CocoShardWriter(object):
+    """
+    write COCO outputs (e.g. from to_coco()) into shards of <images_per_shard> images
+    """
+    def __init__(self, dst, images_per_shard = 1000, annotations_per_shard = None,
+                 prefix = "coco", start_shard = 0):
+        """
+        Args:
+            dst: str, the output folder
+            images_per_shard: int, the number of images in a shard at most
+            annotations_per_shard: int, the id range reserved for the annotations of a shard,
+                                   1000 per image by default
+            prefix: str, the shards are saved as <prefix>_<shard index>.json
+            start_shard: int, the index of the first shard written by write(),
+                         e.g. a different start for each machine
+        """
+        self.dst = dst
+        self.images_per_shard = images_per_shard
+        self.annotations_per_shard = annotations_per_shard or 1000 * images_per_shard
+        self.prefix = prefix
+        self.next_shard = start_shard
+        os.makedirs(dst, exist_ok = True)
+
+    def shard_path(self, shard_index):
+        """
+        the path of the shard <shard_index>
+        """
+        return os.path.join(self.dst, f"{self.prefix}_{shard_index:05d}.json")
+
+    def write(self, coco_output):
+        """
+        split a COCO output into shards of images_per_shard images, written as the next shards
+        Args:
+            coco_output: dict, the COCO format data
+        Return:
+            list[str], the paths of the shards written
+        """
+        annotation_index = defaultdict(list)
+        for annotation in coco_output["annotations"]:
+            annotation_index[annotation["image_id"]].append(annotation)
+        images = coco_output["images"]
+        paths = []
+        for start in range(0, len(images), self.images_per_shard):
+            shard_images = images[start:start+self.images_per_shard]
+            shard = dict(coco_output)
+            shard["images"] = shard_images
+            shard["annotations"] = [annotation for image in shard_images
+                                    for annotation in annotation_index.get(image["id"], [])]
+            paths.append(self.write_shard(shard, self.next_shard))
+            self.next_shard += 1
+        return paths
+
+    def write_shard(self, coco_output, shard_index):
+        """
+        write a COCO output of images_per_shard images at most as the shard <shard_index>,
+        the image and annotation ids are renumbered into the ranges of the shard
+        Args:
+            coco_output: dict, the COCO format data
+            shard_index: int, the index of the shard
+        Return:
+            str, the path of the shard
+        """
+        images = coco_output["images"]
+        annotations = coco_output["annotations"]
+        assert len(images) <= self.images_per_shard, \
+            f"{len(images)} images are more than {self.images_per_shard} in a shard"
+        assert len(annotations) <= self.annotations_per_shard, \
+            f"{len(annotations)} annotations are more than {self.annotations_per_shard} in a shard"
+        image_start = shard_index * self.images_per_shard
+        annotation_start = shard_index * self.annotations_per_shard
+        image_ids = {}
+        shard_images = []
+        for index, image in enumerate(images):
+            image_ids[image["id"]] = image_start + index + 1
+            shard_images.append(dict(image, id = image_start + index + 1))
+        # the annotations without an image in this shard are not written
+        shard_annotations = [dict(annotation, image_id = image_ids[annotation["image_id"]],
+                                  id = annotation_start + index + 1)
+                             for index, annotation in enumerate(annotations)
+                             if annotation["image_id"] in image_ids]
+        shard = dict(coco_output)
+        shard["images"] = shard_images
+        shard["annotations"] = shard_annotations
+        path = self.shard_path(shard_index)
+        jsonio.dump(shard, path)
+        return path
+
+def merge_shards(paths, dst):
+    """
+    merge the COCO shards into one COCO file, the shards are read one by one,
+    only one of them is in the memory at a time.
+    The "info" and "licenses" are from the first shard, the categories are merged
+    by their names, and the category_id of the annotations follows.
+    Args:
+        paths: list[str], the paths of the shards, in the order of the output
+        dst: str, the path of the merged file
+    Return:
+        str, <dst>
+    """
+    categories = []
+    category_ids = {}
+    head = None
+    # the images are written to <dst> directly, the annotations are put aside
+    # in a temporary file next to it, and appended after all the images
+    with open(dst, "w", encoding = "utf-8") as output, \
+         tempfile.TemporaryFile("w+", encoding = "utf-8", dir = os.path.dirname(os.path.abspath(dst))) as spill:
+        output.write('{"images":[')
+        image_separator = annotation_separator = ""
+        for path in paths:
+            shard = jsonio.load(path)
+            if head is None:
+                head = {field: value for field, value in shard.items()
+                        if field not in ("images", "annotations", "categories")}
+            # a category is known by its name, the new ones are given the next ids
+            remap = {}
+            for category in shard.get("categories", []):
+                if category["name"] not in category_ids:
+                    id = category["id"] if category["id"] not in {c["id"] for c in categories} \
+                         else max(c["id"] for c in categories) + 1
+                    category_ids[category["name"]] = id
+                    categories.append(dict(category, id = id))
+                remap[category["id"]] = category_ids[category["name"]]
+            if shard["images"]:
+                output.write(image_separator)
+                # the list is serialized at once, its brackets are dropped
+                output.write(jsonio.dumps(shard["images"])[1:-1])
+                image_separator = ","
+            annotations = shard["annotations"]
+            if any(remap[annotation["category_id"]] != annotation["category_id"] for annotation in annotations):
+                annotations = [dict(annotation, category_id = remap[annotation["category_id"]])
+                               for annotation in annotations]
+            if annotations:
+                spill.write(annotation_separator)
+                spill.write(jsonio.dumps(annotations)[1:-1])
+                annotation_separator = ","
+            del shard, annotations
+        output.write('],"annotations":[')
+        spill.seek(0)
+        shutil.copyfileobj(spill, output)
+        output.write('],"categories":')
+        output.write(jsonio.dumps(categories))
+        for field, value in (head or {}).items():
+            output.write(f",{jsonio.dumps(field)}:{jsonio.dumps(value)}")
+        output.write("}")
+    return dst
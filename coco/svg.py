@@ -0,0 +1,104 @@
+"""
+parse the SVG selectors of Annotorious (https://recogito.github.io/annotorious/)
+into coco format contours, the coordinates are converted in bulk by numpy
+rather than one float() call each
+"""
+import numpy as np
+import re
+
+_POINTS = re.compile(r"""points\s*=\s*\\?["']([^"'\\]*)""")
+_PATH = re.compile(r"""\sd\s*=\s*\\?["']([^"'\\]*)""")
+_NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+_NUMBER_TOKEN = re.compile(_NUMBER)
+_PATH_TOKEN = re.compile(rf"[A-Za-z]|{_NUMBER}")
+# a path only with absolute moveto, lineto and closepath, as the freehand tool draws
+_ABSOLUTE_PATH = re.compile(r"[MLZ0-9eE.,+\-\s]*")
+
+def svg_to_contours(value):
+    """
+    parse an Annotorious SVG selector value, in <polygon points="..."> or <path d="...">
+    args:
+        value: str, the "value" of the SvgSelector
+    return:
+        list[np.ndarray], the float64 coco format contours [x_1,y_1,x_2,y_2,...],
+        a <path> with several sub-paths gives one contour each
+    """
+    match = _POINTS.search(value)
+    if match:
+        # the points are separated by spaces, x and y by a comma (or a space)
+        return [_parse_numbers(match.group(1))]
+    match = _PATH.search(value)
+    if match:
+        contours = _parse_path(match.group(1))
+        if contours:
+            return contours
+    raise ValueError(f"neither a polygon nor a path in the svg selector: {value[:100]}")
+
+def _parse_numbers(string):
+    """
+    helper function of svg_to_contours(), convert all the numbers in <string> in one call,
+    they're found by the number pattern rather than split on the separators,
+    as the SVG numbers can be separated by their signs only, e.g. "10-20"
+    """
+    numbers = np.array(_NUMBER_TOKEN.findall(string), dtype = np.float64)
+    if len(numbers) % 2:
+        raise ValueError(f"odd number of coordinates: {string[:100]}")
+    return numbers
+
+def _parse_path(path):
+    """
+    helper function of svg_to_contours(), parse the "d" of a <path>
+    the moveto (M/m), lineto (L/l, H/h, V/v) and closepath (Z/z) commands are supported,
+    the curves are not as Annotorious never draws them
+    """
+    path = path.strip()
+    # the fast way: with only M, L and Z, each sub-path is a plain list of points
+    if _ABSOLUTE_PATH.fullmatch(path):
+        subpaths = re.split(r"[MZ]", path)
+        return [_parse_numbers(subpath.replace("L", " ")) for subpath in subpaths if subpath.strip()]
+    # otherwise, walk through the commands
+    contours = []
+    current = []
+    x = y = start_x = start_y = 0.0
+    command = None
+    tokens = _PATH_TOKEN.findall(path)
+    i = 0
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command in "Zz":
+                if current:
+                    contours.append(current)
+                current = []
+                x, y = start_x, start_y
+            continue
+        if command is None:
+            raise ValueError(f"the path does not start with a command: {path[:100]}")
+        relative = command.islower()
+        if command in "MmLl" and (i + 1 >= len(tokens) or tokens[i+1].isalpha()):
+            raise ValueError(f"a point of the path is incomplete: {path[:100]}")
+        if command in "Mm":
+            if current:
+                contours.append(current)
+            current = []
+            x, y = (x if relative else 0) + float(tokens[i]), (y if relative else 0) + float(tokens[i+1])
+            start_x, start_y = x, y
+            # the pairs following a moveto are linetos
+            command = "l" if relative else "L"
+            i += 2
+        elif command in "Ll":
+            x, y = (x if relative else 0) + float(tokens[i]), (y if relative else 0) + float(tokens[i+1])
+            i += 2
+        elif command in "Hh":
+            x = (x if relative else 0) + float(tokens[i])
+            i += 1
+        elif command in "Vv":
+            y = (y if relative else 0) + float(tokens[i])
+            i += 1
+        else:
+            raise ValueError(f"unsupported path command {command}")
+        current += [x, y]
+    if current:
+        contours.append(current)
+    return [np.array(contour, dtype = np.float64) for contour in contours]
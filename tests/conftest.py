@@ -0,0 +1,5 @@
+# the packages are used from the root of the repository, there's no installation
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
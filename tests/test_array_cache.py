@@ -0,0 +1,62 @@
+"""
+an ArrayCache passed to the workers of a process pool is opened once in each worker
+"""
+import multiprocessing
+import pickle
+import numpy as np
+import cv2
+import pytest
+from coco.mask import MaskInterpreter
+from vision import array_cache as array_cache_module
+from vision.array_cache import ArrayCache, build_array_cache
+
+def _write_masks(directory, count):
+    for index in range(count):
+        mask = np.zeros((40, 50, 3), dtype = np.uint8)
+        cv2.rectangle(mask, (index, 5), (index+20, 30), (10, 200, 30), -1)
+        cv2.imwrite(str(directory / f"{index}_mask.png"), mask[:, :, ::-1])
+
+@pytest.fixture
+def opens(monkeypatch, tmp_path):
+    """
+    the paths of the caches opened, also in the forked workers, through a log file
+    """
+    log = tmp_path / "opens.log"
+    log.touch()
+    init = ArrayCache.__init__
+    def logged_init(self, path):
+        with open(log, "a") as file:
+            file.write(path + "\n")
+        init(self, path)
+    monkeypatch.setattr(ArrayCache, "__init__", logged_init)
+    monkeypatch.setattr(array_cache_module, "_opened", {})
+    return lambda: log.read_text().splitlines()
+
+def test_unpickled_cache_is_opened_once(tmp_path, opens):
+    _write_masks(tmp_path, 3)
+    cache = build_array_cache(str(tmp_path), str(tmp_path / "masks"), decode = "unchanged")
+    copies = [pickle.loads(pickle.dumps(cache)) for _ in range(5)]
+    # the build opens it, the copies share one more opening
+    assert len(opens()) == 2
+    for copy in copies:
+        assert copy.names == cache.names
+        assert np.array_equal(copy[0], cache[0])
+    # a rebuilt cache is opened again
+    build_array_cache(str(tmp_path), str(tmp_path / "masks"), decode = "unchanged")
+    pickle.loads(pickle.dumps(cache))
+    assert len(opens()) == 4
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason = "the opens of the workers are counted through the patched __init__ they fork")
+def test_process_pool_opens_the_cache_once_per_worker(tmp_path, opens):
+    _write_masks(tmp_path, 12)
+    cache = build_array_cache(str(tmp_path), str(tmp_path / "masks"), decode = "unchanged")
+    label_dictionary = {(10, 200, 30): "box"}
+    serial = MaskInterpreter()._to_coco((str(tmp_path), label_dictionary), array_cache = cache)
+    parallel = MaskInterpreter()._to_coco((str(tmp_path), label_dictionary), workers = 2, array_cache = cache)
+    assert parallel["images"] == serial["images"]
+    assert [(annotation["area"], list(annotation["bbox"])) for annotation in parallel["annotations"]] == \
+           [(annotation["area"], list(annotation["bbox"])) for annotation in serial["annotations"]]
+    assert len(serial["annotations"]) == 12
+    # the build, then one opening in each of the 2 workers at most
+    assert 2 <= len(opens()) <= 3
@@ -0,0 +1,37 @@
+"""
+the images read from np.ndarray inputs never share the buffer of the caller
+"""
+import numpy as np
+import cv2
+import pytest
+from vision.image_io import read_image, use_array_cache
+from vision.array_cache import build_array_cache
+from vision.utils import cvread, unify_image_format
+
+@pytest.mark.parametrize("read", [read_image, cvread, unify_image_format])
+@pytest.mark.parametrize("channels", [None, 3, 4])
+def test_ndarray_input_is_copied(read, channels):
+    shape = (6, 5) if channels is None else (6, 5, channels)
+    src = np.arange(np.prod(shape), dtype = np.uint8).reshape(shape)
+    original = src.copy()
+    output = read(src)
+    assert output.shape == (6, 5, 3) and output.flags.c_contiguous and output.flags.writeable
+    assert np.array_equal(output, np.dstack([original]*3) if channels is None else original[..., :3])
+    assert not np.shares_memory(output, src)
+    output[...] = 255
+    assert np.array_equal(src, original)
+
+def test_array_cache_view_is_not_written(tmp_path):
+    image = np.random.default_rng(0).integers(0, 256, (8, 9, 3), dtype = np.uint8)
+    cv2.imwrite(str(tmp_path / "a.png"), image[:, :, ::-1])
+    cache = build_array_cache(str(tmp_path), str(tmp_path / "images"))
+    use_array_cache(cache)
+    try:
+        assert not read_image(str(tmp_path / "a.png")).flags.writeable
+        for read in (cvread, unify_image_format):
+            output = read(str(tmp_path / "a.png"))
+            assert np.array_equal(output, image) and output.flags.writeable
+            output[...] = 0
+            assert np.array_equal(cache["a.png"], image)
+    finally:
+        use_array_cache(None)
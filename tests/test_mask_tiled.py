@@ -0,0 +1,57 @@
+"""
+the tiled tracing of MaskInterpreter gives the same annotations as the complete mask
+"""
+import numpy as np
+import cv2
+import pytest
+from coco.mask import MaskInterpreter
+from coco.utils import pack_color
+
+def _canonical(annotations):
+    return [(annotation["category_id"], [contour.tolist() for contour in annotation["segmentation"]],
+             annotation["area"], tuple(int(value) for value in annotation["bbox"]))
+            for annotation in annotations]
+
+def _random_mask(rng, palette):
+    height, width = rng.integers(50, 260, 2)
+    labels = np.zeros((height, width), dtype = np.int64)
+    for _ in range(rng.integers(1, 25)):
+        disk = np.zeros((height, width), dtype = np.uint8)
+        cv2.circle(disk, (int(rng.integers(0, width)), int(rng.integers(0, height))),
+                   int(rng.integers(2, 80)), 1, int(rng.choice([-1, 2, 5])))
+        labels[disk > 0] = rng.integers(0, len(palette)+1)
+    noise = rng.random((height, width)) < 0.02
+    labels[noise] = rng.integers(0, len(palette)+1, noise.sum())
+    return np.where(labels[..., None] > 0, palette[np.maximum(labels, 1)-1], 0).astype(np.uint8)
+
+def test_annulus_is_one_polygon():
+    mask = np.zeros((300, 280, 3), dtype = np.uint8)
+    cv2.circle(mask, (140, 150), 120, (200, 10, 10), -1)
+    cv2.circle(mask, (140, 150), 60, (0, 0, 0), -1)
+    category_ids = {pack_color((200, 10, 10)): 1}
+    untiled = MaskInterpreter()._extract_labels(mask, category_ids)
+    for stitch_limit in (None, 1):
+        tiled = MaskInterpreter()._extract_labels_tiled(mask, category_ids, 64, stitch_limit = stitch_limit)
+        assert len(tiled[0]["segmentation"]) == 1
+        assert _canonical(tiled) == _canonical(untiled)
+
+def test_island_in_a_linked_hole_is_dropped():
+    mask = np.zeros((600, 600, 3), dtype = np.uint8)
+    cv2.circle(mask, (300, 300), 280, (9, 9, 9), -1)
+    cv2.circle(mask, (300, 300), 140, (0, 0, 0), -1)
+    cv2.circle(mask, (300, 300), 60, (9, 9, 9), -1)
+    category_ids = {pack_color((9, 9, 9)): 1}
+    untiled = MaskInterpreter()._extract_labels(mask, category_ids)
+    tiled = MaskInterpreter()._extract_labels_tiled(mask, category_ids, 64, stitch_limit = 1)
+    assert _canonical(tiled) == _canonical(untiled)
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("tile_size, stitch_limit", [(16, None), (37, None), (37, 1), (64, 1)])
+def test_random_masks(seed, tile_size, stitch_limit):
+    rng = np.random.default_rng(seed)
+    palette = np.random.default_rng(100).integers(1, 256, (6, 3)).astype(np.uint8)
+    category_ids = {pack_color(color): index+1 for index, color in enumerate(palette)}
+    mask = _random_mask(rng, palette)
+    untiled = MaskInterpreter()._extract_labels(mask, category_ids)
+    tiled = MaskInterpreter()._extract_labels_tiled(mask, category_ids, tile_size, stitch_limit = stitch_limit)
+    assert _canonical(tiled) == _canonical(untiled)
@@ -0,0 +1,69 @@
+"""
+the numpy RLE codec of coco.rle gives the same RLE as pycocotools
+"""
+import numpy as np
+import pytest
+from coco.rle import rle_encode, rle_decode, rle_to_string, rle_from_string, rle_area_and_bbox
+
+@pytest.fixture(scope = "module")
+def mask_utils():
+    return pytest.importorskip("pycocotools.mask")
+
+def _random_masks(count, seed = 0):
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        height, width = rng.integers(1, 80, 2)
+        kind = rng.integers(0, 4)
+        if kind == 0:
+            # sparse noise, many short runs
+            mask = rng.random((height, width)) < rng.random() * 0.2
+        elif kind == 1:
+            # blobs, runs going across the columns when they touch the bottom and the top
+            mask = np.zeros((height, width), dtype = bool)
+            for _ in range(rng.integers(1, 6)):
+                y0, x0 = rng.integers(0, height), rng.integers(0, width)
+                mask[y0:y0+rng.integers(1, height+1), x0:x0+rng.integers(1, width+1)] = True
+        elif kind == 2:
+            mask = np.full((height, width), rng.random() < 0.5)
+        else:
+            mask = rng.random((height, width)) < 0.5
+        yield np.asfortranarray(mask.astype(np.uint8))
+
+def _crop(mask):
+    """
+    the tight crop of the foreground and its (x, y) offset
+    """
+    ys, xs = np.nonzero(mask)
+    if not len(ys):
+        return mask[:0, :0], (0, 0)
+    return mask[ys.min():ys.max()+1, xs.min():xs.max()+1], (int(xs.min()), int(ys.min()))
+
+# pycocotools.mask.decode warns on numpy 2
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+def test_rle_matches_pycocotools(mask_utils):
+    for mask in _random_masks(300):
+        rle = rle_encode(mask)
+        expected = mask_utils.encode(mask)
+        assert rle["size"] == list(expected["size"])
+        # the string form
+        string = rle_to_string(rle["counts"])
+        assert string == expected["counts"].decode("ascii")
+        assert rle_from_string(expected["counts"]) == rle["counts"]
+        # the area and the bounding box, from both the counts and the string
+        for counts in (rle["counts"], string):
+            area, bbox = rle_area_and_bbox({"size": rle["size"], "counts": counts})
+            assert area == int(mask_utils.area(expected))
+            assert bbox == mask_utils.toBbox(expected).astype(np.int64).tolist()
+        assert np.array_equal(rle_decode({"size": rle["size"], "counts": string}), mask_utils.decode(expected))
+
+def test_crop_encoding_matches_pycocotools(mask_utils):
+    for mask in _random_masks(300, seed = 1):
+        crop, offset = _crop(mask)
+        rle = rle_encode(crop, size = mask.shape, offset = offset)
+        assert rle_to_string(rle["counts"]) == mask_utils.encode(mask)["counts"].decode("ascii")
+
+def test_crop_encoding_matches_the_full_mask():
+    for mask in _random_masks(300, seed = 2):
+        crop, offset = _crop(mask)
+        assert rle_encode(crop, size = mask.shape, offset = offset) == rle_encode(mask)
+        assert np.array_equal(rle_decode(rle_encode(mask)), mask)
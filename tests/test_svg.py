@@ -0,0 +1,29 @@
+"""
+the SVG selectors of Annotorious are parsed into the same contours whatever their number separators
+"""
+import numpy as np
+import pytest
+from coco.svg import svg_to_contours
+
+@pytest.mark.parametrize("value", [
+    '<svg><path d="M10-20L30-40L50-10Z"></path></svg>',
+    '<svg><path d="M10,-20 L30,-40 L50,-10 Z"></path></svg>',
+    # the command walker, with the relative lineto
+    '<svg><path d="M10-20l20-20l20 30z"></path></svg>',
+])
+def test_sign_separated_path(value):
+    contours = svg_to_contours(value)
+    assert len(contours) == 1
+    assert contours[0].tolist() == [10, -20, 30, -40, 50, -10]
+
+def test_sign_separated_polygon():
+    contours = svg_to_contours('<svg><polygon points="10-20 30-40 .5.5 1e1-2e1"></polygon></svg>')
+    assert contours[0].tolist() == [10, -20, 30, -40, 0.5, 0.5, 10, -20]
+
+def test_several_subpaths():
+    contours = svg_to_contours('<svg><path d="M0 0L4 0L4 3ZM10-10L12-10L12-8Z"></path></svg>')
+    assert [contour.tolist() for contour in contours] == [[0, 0, 4, 0, 4, 3], [10, -10, 12, -10, 12, -8]]
+
+def test_odd_coordinates_are_rejected():
+    with pytest.raises(ValueError):
+        svg_to_contours('<svg><polygon points="10-20 30"></polygon></svg>')
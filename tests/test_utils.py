@@ -0,0 +1,89 @@
+"""
+the vectorized helpers of coco.utils give what the list building, the cv2 calls and the scans per label gave
+"""
+import numpy as np
+import cv2
+import pytest
+from coco.mask import MaskInterpreter
+from coco.utils import coco_contour_to_cv2, coco_contours_to_buffer, polygon_area_and_bbox, label_regions
+
+def _old_coco_contour_to_cv2(contour, dtype):
+    # the point by point version replaced by the vectorized one
+    return np.array([[[contour[2*i], contour[2*i+1]]]
+                      for i in range(int(len(contour)/2))],
+                      dtype = dtype)
+
+def _random_contours(rng, count):
+    contours = []
+    for _ in range(count):
+        size = int(rng.integers(3, 40)) * 2 + int(rng.integers(0, 2))
+        contours.append((rng.random(size) * 500 - 50).round(int(rng.integers(0, 3))).tolist())
+    return contours
+
+@pytest.mark.parametrize("dtype", [np.float32, np.int32, np.float64])
+def test_coco_contour_to_cv2_matches_the_list_building(dtype):
+    rng = np.random.default_rng(0)
+    for contour in _random_contours(rng, 200) + [[], [1.5], [1, 2, 3]]:
+        expected = _old_coco_contour_to_cv2(contour, dtype)
+        output = coco_contour_to_cv2(contour, dtype = dtype)
+        assert output.dtype == expected.dtype
+        # the old version gave a (0,) array for no point
+        assert output.reshape(-1, 1, 2).shape == expected.reshape(-1, 1, 2).shape
+        assert np.array_equal(output.reshape(-1, 1, 2), expected.reshape(-1, 1, 2))
+        assert np.array_equal(coco_contour_to_cv2(np.array(contour), dtype = dtype).reshape(-1, 1, 2),
+                              expected.reshape(-1, 1, 2))
+
+@pytest.mark.parametrize("dtype", [np.float32, np.int32, np.float64])
+def test_coco_contours_to_buffer_matches_the_list_building(dtype):
+    rng = np.random.default_rng(1)
+    contours = _random_contours(rng, 100) + [[]]
+    rng.shuffle(contours)
+    points, offsets = coco_contours_to_buffer(contours, dtype = dtype)
+    assert points.dtype == dtype and points.shape[1] == 2
+    assert offsets[0] == 0 and offsets[-1] == len(points) and len(offsets) == len(contours)+1
+    for contour, start, end in zip(contours, offsets[:-1], offsets[1:]):
+        assert np.array_equal(points[start:end], _old_coco_contour_to_cv2(contour, dtype).reshape(-1, 2))
+    points, offsets = coco_contours_to_buffer([], dtype = dtype)
+    assert points.shape == (0, 2) and offsets.tolist() == [0]
+
+def test_polygon_area_and_bbox_matches_cv2():
+    rng = np.random.default_rng(2)
+    contours = _random_contours(rng, 300)
+    # the contours of a real mask too, in integer pixels
+    mask = np.zeros((200, 200), dtype = np.uint8)
+    for _ in range(30):
+        cv2.circle(mask, tuple(int(value) for value in rng.integers(0, 200, 2)), int(rng.integers(1, 30)), 1, -1)
+    traced, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    contours += [contour.ravel().tolist() for contour in traced]
+    points, offsets = coco_contours_to_buffer(contours, dtype = np.float32)
+    areas, bboxes = polygon_area_and_bbox(points, offsets)
+    for index, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        contour = points[start:end].reshape(-1, 1, 2)
+        assert areas[index] == pytest.approx(cv2.contourArea(contour), rel = 1e-6, abs = 1e-6)
+        assert bboxes[index].tolist() == list(cv2.boundingRect(contour))
+
+def test_polygon_area_and_bbox_of_empty_polygons():
+    points, offsets = coco_contours_to_buffer([[], [0, 0, 4, 0, 4, 3], [1]], dtype = np.float32)
+    areas, bboxes = polygon_area_and_bbox(points, offsets)
+    assert areas.tolist() == [0, 6, 0]
+    assert bboxes.tolist() == [[0, 0, 0, 0], [0, 0, 5, 4], [0, 0, 0, 0]]
+    areas, bboxes = polygon_area_and_bbox(*coco_contours_to_buffer([]))
+    assert areas.shape == (0,) and bboxes.shape == (0, 4)
+
+@pytest.mark.parametrize("shape", [(0, 0), (0, 5), (5, 0)])
+def test_label_regions_of_an_empty_map(shape):
+    labels, regions = label_regions(np.zeros(shape, dtype = np.uint32))
+    assert labels.shape == (0,) and regions == []
+    # an empty mask translates into an image without annotation
+    mask = np.zeros(shape + (3,), dtype = np.uint8)
+    coco = MaskInterpreter()._to_coco(([mask], [mask], {(1, 2, 3): "a"}))
+    assert coco["annotations"] == [] and len(coco["images"]) == 1
+
+def test_label_regions_match_the_label_pixels():
+    label_map = np.random.default_rng(3).integers(0, 6, (40, 30)).astype(np.uint32)
+    label_map[label_map == 4] = 0
+    labels, regions = label_regions(label_map)
+    assert labels.tolist() == np.unique(label_map).tolist()
+    for label, (rows, columns) in zip(labels, regions):
+        ys, xs = np.nonzero(label_map == label)
+        assert (rows.start, rows.stop, columns.start, columns.stop) == (ys.min(), ys.max()+1, xs.min(), xs.max()+1)
@@ -0,0 +1,194 @@
+"""
+a packed on-disk cache of the decoded images and masks of a dataset:
+every file is decoded once into <dst>.bin, a raw uint8 blob holding the arrays one after
+another, and <dst>.json, the index of their offsets, shapes and dtypes.
+The blob is memory-mapped, so an array is served as a zero-copy view of the page cache,
+the repeated epochs and conversions only pay for the I/O, not for the PNG/JPEG decoding.
+A built cache is used by vision.utils.unify_image_format and vision.image_io.read_image
+once it's registered with vision.image_io.use_array_cache(), by MaskInterpreter.to_coco()
+through its array_cache argument, and by the training loaders directly, as a sequence of arrays
+"""
+from concurrent.futures import ThreadPoolExecutor
+from .image_io import read_image
+import numpy as np
+import json
+import cv2
+import os
+
+_VERSION = 1
+# every array starts at a multiple of this, so the views are aligned for any dtype
+_ALIGNMENT = 64
+_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+def _decode_rgb(path):
+    """
+    the images, as vision.image_io.read_image() decodes them
+    """
+    return read_image(path, cache = False)
+
+def _decode_unchanged(path):
+    """
+    the masks, as the file holds them (single channel, RGB or RGBA, 8 or 16-bit),
+    as MaskInterpreter decodes its color masks
+    """
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError(f"cannot read {path}")
+    if img.ndim == 3 and img.shape[2] == 4:
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2RGBA)
+    if img.ndim == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return img
+
+DECODERS = {"rgb": _decode_rgb, "unchanged": _decode_unchanged}
+
+# the caches opened in this process by unpickling, keyed by the path and the stat of the files,
+# so a process pool worker opens a cache once, rather than once for every task pickling it
+_opened = {}
+
+def _source_files(src, extensions):
+    """
+    the root and the sorted files of a directory, or the files listed
+    """
+    if isinstance(src, (str, os.PathLike)):
+        root = os.path.abspath(src)
+        assert os.path.isdir(root), root
+        paths = sorted(os.path.join(directory, file_name)
+                       for directory, _, file_names in os.walk(root)
+                       for file_name in file_names if file_name.lower().endswith(extensions))
+        return root, paths
+    return None, [os.path.abspath(path) for path in src]
+
+def build_array_cache(src, dst, decode = "rgb", extensions = _EXTENSIONS, workers = None):
+    """
+    decode all the images of <src> once into the cache <dst>
+    Args:
+        src: str, a directory, all the files with <extensions> in it and its sub-directories
+             are cached, named by their paths relative to it,
+             or list[str], the files, named by their absolute paths
+        dst: str, the cache is written to <dst>.bin and <dst>.json
+        decode: str, "rgb" for the images (3-channel RGB), "unchanged" for the masks,
+                see DECODERS, or a function from a path to a np.ndarray
+        extensions: tuple[str], the file extensions cached from a directory
+        workers: int, the number of threads decoding, cv2 and PIL release the GIL
+    Return:
+        ArrayCache, the cache built
+    """
+    decoder = DECODERS[decode] if isinstance(decode, str) else decode
+    root, paths = _source_files(src, extensions)
+    entries = []
+    offset = 0
+    # written aside then renamed, so a failed build never leaves a broken cache behind
+    with open(dst + ".bin.tmp", "wb") as blob:
+        if workers is None or workers <= 1:
+            arrays = map(decoder, paths)
+        else:
+            executor = ThreadPoolExecutor(max_workers = workers)
+            arrays = executor.map(decoder, paths)
+        try:
+            for path, array in zip(paths, arrays):
+                array = np.ascontiguousarray(array)
+                stat = os.stat(path)
+                entries.append({"name": os.path.relpath(path, root) if root else path,
+                                "offset": offset,
+                                "shape": list(array.shape),
+                                "dtype": array.dtype.str,
+                                "mtime_ns": stat.st_mtime_ns,
+                                "size": stat.st_size})
+                array.tofile(blob)
+                padding = -array.nbytes % _ALIGNMENT
+                blob.write(b"\0" * padding)
+                offset += array.nbytes + padding
+        finally:
+            if workers is not None and workers > 1:
+                executor.shutdown()
+    with open(dst + ".json.tmp", "w", encoding = "utf-8") as index:
+        json.dump({"version": _VERSION, "root": root, "decode": decode if isinstance(decode, str) else None,
+                   "entries": entries}, index)
+    os.replace(dst + ".bin.tmp", dst + ".bin")
+    os.replace(dst + ".json.tmp", dst + ".json")
+    return ArrayCache(dst)
+
+class ArrayCache(object):
+    """
+    a cache built by build_array_cache(), the arrays are np.memmap views of the blob,
+    mapped copy-on-write: they can be written, but the writes stay in this process
+    and never change the cache.
+    cache[i] and cache[name] give the array of the i-th or the named file,
+    so it can serve a training loader directly
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path: str, the <dst> of build_array_cache()
+        """
+        self.path = path
+        with open(path + ".json", encoding = "utf-8") as index:
+            index = json.load(index)
+        assert index["version"] == _VERSION, f"the cache {path} is in version {index['version']}, not {_VERSION}"
+        self.root = index["root"]
+        self.decode = index["decode"]
+        self.entries = index["entries"]
+        self.names = [entry["name"] for entry in self.entries]
+        self._positions = {name: position for position, name in enumerate(self.names)}
+        # np.memmap can't map an empty file
+        self._blob = np.memmap(path + ".bin", dtype = np.uint8, mode = "c") \
+                     if os.path.getsize(path + ".bin") else np.zeros(0, np.uint8)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def __getitem__(self, key):
+        """
+        the array of the i-th file, or of the file named <key>
+        """
+        entry = self.entries[key if isinstance(key, (int, np.integer)) else self._positions[key]]
+        dtype = np.dtype(entry["dtype"])
+        nbytes = int(np.prod(entry["shape"], dtype = np.int64)) * dtype.itemsize
+        return self._blob[entry["offset"]:entry["offset"]+nbytes].view(dtype).reshape(entry["shape"])
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def lookup(self, path):
+        """
+        the array of the file <path> if it's in the cache and unchanged since the cache was built,
+        otherwise None, e.g. a file out of the cached directory, or rewritten since then
+        """
+        path = os.path.abspath(path)
+        if self.root is not None:
+            if os.path.commonpath([self.root, path]) != self.root:
+                return None
+            path = os.path.relpath(path, self.root)
+        position = self._positions.get(path)
+        if position is None:
+            return None
+        entry = self.entries[position]
+        try:
+            stat = os.stat(os.path.join(self.root, path) if self.root else path)
+        except OSError:
+            return self[position]
+        if (stat.st_mtime_ns, stat.st_size) != (entry["mtime_ns"], entry["size"]):
+            return None
+        return self[position]
+
+    def __getstate__(self):
+        # the workers of a process pool re-open the cache rather than receiving the arrays
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        path = state["path"]
+        # a rebuilt cache has other stats, so it's opened again
+        key = (os.path.abspath(path),) + tuple((stat.st_mtime_ns, stat.st_size)
+                                               for stat in map(os.stat, (path + ".json", path + ".bin")))
+        opened = _opened.get(key)
+        if opened is None:
+            self.__init__(path)
+            _opened[key] = self
+        else:
+            # the index and the memory map are only read, so they're shared
+            self.__dict__.update(opened.__dict__)
@@ -0,0 +1,92 @@
+"""
+color analysis of images and masks: every RGB(A) pixel is packed into one uint32,
+so the unique colors and their pixel counts are found on a 1D integer array
+(np.bincount when it's worth it) rather than by np.unique(axis=0), which sorts the rows
+"""
+import numpy as np
+
+# np.bincount is used when there are at least this many pixels, below it,
+# the 2^24 bins cost more than sorting the pixels
+_BINCOUNT_MIN_PIXELS = 1 << 20
+
+def pack_colors(img):
+    """
+    pack the colors of <img> into uint32, the first channel in the highest byte,
+    so the order of the packed colors is the lexicographic order of the colors
+    Args:
+        img: np.ndarray, uint8 in (..., C) shape with C <= 4
+    Returns:
+        np.ndarray, uint32 in (...) shape
+    """
+    img = np.asarray(img)
+    assert img.dtype == np.uint8 and img.shape[-1] <= 4, f"{img.dtype} {img.shape} is not a uint8 RGB(A) image"
+    packed = img[..., 0].astype(np.uint32)
+    for channel in range(1, img.shape[-1]):
+        packed <<= 8
+        packed |= img[..., channel]
+    return packed
+
+def unpack_colors(packed, channels = 3):
+    """
+    the reverse of pack_colors()
+    Args:
+        packed: np.ndarray, the packed colors
+        channels: int, the number of channels packed
+    Returns:
+        np.ndarray, uint8 in (..., channels) shape
+    """
+    packed = np.asarray(packed, dtype = np.uint32)
+    shifts = np.arange(channels-1, -1, -1, dtype = np.uint32) * 8
+    return ((packed[..., None] >> shifts) & 0xff).astype(np.uint8)
+
+def _count(packed, channels):
+    """
+    the unique packed colors and their counts, sorted
+    """
+    packed = packed.ravel()
+    if channels <= 3 and packed.size >= _BINCOUNT_MIN_PIXELS:
+        # 24 bits at most, one linear pass over the pixels
+        counts = np.bincount(packed, minlength = 1)
+        codes = np.flatnonzero(counts)
+        return codes.astype(np.uint32), counts[codes]
+    return np.unique(packed, return_counts = True)
+
+def unique_colors(img, return_counts = False):
+    """
+    get all the unique colors in an image, or in a batch of images
+    the output is the same as np.unique(img.reshape(-1, C), axis = 0)
+    Args:
+        img: np.ndarray, uint8 in (H, W, C) or (N, H, W, C) shape, C <= 4
+        return_counts: bool, if True, the number of pixels of each color is returned too
+    Returns:
+        colors: np.ndarray, uint8 in (K, C) shape, the unique colors, sorted
+        counts: np.ndarray, int64 in (K,) shape, only if return_counts
+    """
+    channels = img.shape[-1]
+    codes, counts = _count(pack_colors(img), channels)
+    colors = unpack_colors(codes, channels)
+    return (colors, counts) if return_counts else colors
+
+def color_histogram(images):
+    """
+    count the colors of a batch of images in one call
+    Args:
+        images: np.ndarray, uint8 in (N, H, W, C) shape, C <= 4, or a list of (H, W, C) images
+    Returns:
+        colors: np.ndarray, uint8 in (K, C) shape, the unique colors in all the images, sorted
+        counts: np.ndarray, int64 in (N, K) shape, counts[i, k] is the number of pixels in
+                colors[k] of the image i
+    """
+    channels = images[0].shape[-1]
+    if isinstance(images, np.ndarray):
+        # the whole batch is packed at once, and no concatenation is needed
+        packed = pack_colors(images).reshape(len(images), -1)
+        codes, _ = _count(packed, channels)
+    else:
+        packed = [pack_colors(image).ravel() for image in images]
+        codes, _ = _count(np.concatenate(packed), channels)
+    counts = np.zeros((len(packed), len(codes)), dtype = np.int64)
+    for i, image_codes in enumerate(packed):
+        # the codes are sorted, so each pixel finds its color by a binary search
+        counts[i] = np.bincount(np.searchsorted(codes, image_codes), minlength = len(codes))
+    return unpack_colors(codes, channels), counts
@@ -0,0 +1,187 @@
+"""
+the image loading layer of the vision tools: any path, np.ndarray or PIL image goes in,
+an RGB np.ndarray comes out. The files are decoded by the fastest decoder at hand,
+cv2 in general, PIL.Image.draft for the reduced JPEGs (the DCT is scaled down while decoding),
+cv2.IMREAD_REDUCED_* for the other reduced previews, and the decoded arrays are kept
+in a size-bounded LRU cache, keyed by the path and the mtime of the file,
+so the tools reading the same images again and again decode each of them once
+"""
+from collections import OrderedDict
+import PIL.Image as Img
+import numpy as np
+import threading
+import cv2
+import os
+
+_JPEG_EXTENSIONS = (".jpg", ".jpeg", ".jpe", ".jfif")
+_CV2_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+class ImageCache(object):
+    """
+    an LRU cache of the decoded images, bounded by the bytes of the arrays kept
+    """
+    def __init__(self, max_bytes = 512 << 20):
+        """
+        Args:
+            max_bytes: int, the total size of the arrays kept at most, 0 disables the cache
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = self.misses = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        the image of <key>, None if it isn't cached
+        """
+        with self._lock:
+            image = self._images.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image):
+        """
+        keep <image> under <key>, the least recently used images are dropped to make room
+        """
+        if image.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._images:
+                self.nbytes -= self._images.pop(key).nbytes
+            self._images[key] = image
+            self.nbytes += image.nbytes
+            self._evict()
+
+    def resize(self, max_bytes):
+        """
+        change the bound, the least recently used images are dropped to fit in it
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        # called with the lock held
+        while self.nbytes > self.max_bytes:
+            _, dropped = self._images.popitem(last = False)
+            self.nbytes -= dropped.nbytes
+
+    def clear(self):
+        """
+        drop all the images
+        """
+        with self._lock:
+            self._images.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._images)
+
+# the cache shared by read_image() and the functions of vision.utils
+image_cache = ImageCache()
+
+def set_cache_size(max_bytes):
+    """
+    resize the shared cache
+    Args:
+        max_bytes: int, 0 disables the cache
+    """
+    image_cache.resize(max_bytes)
+
+# the vision.array_cache.ArrayCache serving the files before they're decoded, see use_array_cache()
+_array_caches = []
+
+def use_array_cache(array_cache):
+    """
+    serve the files of a prebuilt array cache from it rather than decoding them,
+    the files changed since the cache was built are decoded as usual
+    Args:
+        array_cache: vision.array_cache.ArrayCache, or None to stop using all of them
+    """
+    if array_cache is None:
+        _array_caches.clear()
+    elif array_cache not in _array_caches:
+        _array_caches.append(array_cache)
+
+def _from_array_caches(path):
+    """
+    the uint8 array of <path> in the array caches in use, None if there's none
+    """
+    for array_cache in _array_caches:
+        array = array_cache.lookup(path)
+        if array is not None and array.dtype == np.uint8:
+            return array
+    return None
+
+def _decode(path, reduce):
+    """
+    decode the image file <path> into RGB, <reduce> times smaller on each side
+    """
+    if reduce > 1 and path.lower().endswith(_JPEG_EXTENSIONS):
+        # PIL gives RGB directly, and draft() picks the DCT scale
+        with Img.open(path) as image:
+            image.draft("RGB", (image.width // reduce, image.height // reduce))
+            return np.asarray(image.convert("RGB"))
+    image = cv2.imread(path, _CV2_REDUCED_FLAGS[reduce] if reduce > 1 else cv2.IMREAD_COLOR)
+    if image is not None:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    # cv2 doesn't read some formats (e.g. gif) and some paths, PIL is the fallback
+    with Img.open(path) as image:
+        width = image.width // reduce
+        output = image.convert("RGB")
+        if output.width > width:
+            output = output.reduce(reduce)
+        return np.asarray(output)
+
+def read_image(src, reduce = 1, cache = True):
+    """
+    read any image input into an RGB np.ndarray
+    Args:
+        src: str/os.PathLike, the path of the image, or np.ndarray, or PIL.Image
+        reduce: int, 1, 2, 4 or 8, the file is decoded <reduce> times smaller on each side,
+                e.g. for the previews, only applied to the paths
+        cache: bool, whether the decoded file goes through the shared cache,
+               the array caches of use_array_cache() are always looked up first
+    Returns:
+        np.ndarray, uint8 RGB in (H, W, 3) shape for the files and the PIL images.
+        The arrays of the files are shared with the caches, so they are read-only,
+        copy them before writing in them.
+        The np.ndarray inputs are copied without the alpha channel, so the output
+        never shares the buffer of the caller
+    """
+    if isinstance(src, np.ndarray):
+        if src.ndim == 2:
+            return np.repeat(src[..., None], 3, axis = -1)
+        return np.ascontiguousarray(src[..., :3]) if src.shape[2] != 3 else src.copy()
+    if isinstance(src, Img.Image):
+        return np.asarray(src if src.mode == "RGB" else src.convert("RGB"))
+    if not isinstance(src, (str, os.PathLike)):
+        raise TypeError("Invalid image input")
+    assert reduce in (1, 2, 4, 8), f"reduce should be 1, 2, 4 or 8, not {reduce}"
+    path = os.fspath(src)
+    if reduce == 1 and _array_caches:
+        # a zero-copy view, in RGB as the np.ndarray inputs are, read-only as the other
+        # readers of the cache in this process would see its writes
+        array = _from_array_caches(path)
+        if array is not None:
+            if array.ndim != 3 or array.shape[2] != 3:
+                return read_image(array)
+            array = array.view()
+            array.setflags(write = False)
+            return array
+    if not cache or image_cache.max_bytes == 0:
+        return _decode(path, reduce)
+    # a file rewritten since it was cached has another mtime and size, so another key
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, reduce)
+    image = image_cache.get(key)
+    if image is None:
+        image = _decode(path, reduce)
+        image.setflags(write = False)
+        image_cache.put(key, image)
+    return image
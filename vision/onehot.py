@@ -0,0 +1,95 @@
+"""
+one-hot encoding of integer masks: the binary channels are scattered into one
+preallocated uint8/bool buffer, 1 byte per pixel per class rather than the 8 bytes
+of np.where, and can be bit-packed along the classes for storage, 1 bit per class
+"""
+import numpy as np
+
+# the labels are scattered through a lookup table when the mask values are in
+# [0, _LUT_MAX_LABEL], otherwise the mask is compared with all the labels at once
+_LUT_MAX_LABEL = 1 << 16
+
+def _label_lut(mask, labels):
+    """
+    the table from the mask values to the channels, len(labels) for the other values,
+    None if the mask or the labels don't fit in a table
+    """
+    if mask.dtype.kind not in "ui" or labels.dtype.kind not in "ui" or mask.size == 0:
+        return None
+    if labels.min() < 0 or len(np.unique(labels)) != len(labels):
+        return None
+    # uint8 and uint16 masks are in the range of their dtype, no pass over them is needed
+    high = np.iinfo(mask.dtype).max if mask.dtype.itemsize <= 2 and mask.dtype.kind == "u" else None
+    if high is None:
+        if mask.min() < 0:
+            return None
+        high = int(mask.max())
+    if high > _LUT_MAX_LABEL:
+        return None
+    lut = np.full(max(high, int(labels.max())) + 1, len(labels), dtype = np.intp)
+    lut[labels] = np.arange(len(labels))
+    return lut
+
+def one_hot(mask, labels, dtype = np.uint8, out = None):
+    """
+    convert an integer mask, or a batch of them, to binary channels, one for each label
+    Args:
+        mask: np.ndarray, integer in (H, W) or (N, H, W) shape
+        labels: list[int], the mask value of each channel, in the order of the channels
+        dtype: np.uint8 or bool, the dtype of the output when <out> is not given
+        out: np.ndarray, optional, a C-contiguous uint8 or bool buffer in mask.shape + (K,)
+             shape to write in, e.g. reused across the batches of a data loader
+    Returns:
+        np.ndarray, 0/1 in mask.shape + (K,) shape, <out> if it's given
+    """
+    mask = np.asarray(mask)
+    labels = np.array(list(labels))
+    shape = mask.shape + (len(labels),)
+    if out is None:
+        assert np.dtype(dtype) in (np.uint8, np.bool_), f"{dtype} is not uint8 or bool"
+        out = np.empty(shape, dtype = dtype)
+    else:
+        assert out.shape == shape, f"the buffer is in {out.shape} shape, {shape} is expected"
+        assert out.dtype in (np.uint8, np.bool_) and out.flags.c_contiguous, \
+            f"the buffer must be a C-contiguous uint8 or bool array, not {out.dtype}"
+    if not len(labels):
+        return out
+    lut = _label_lut(mask, labels)
+    if lut is None:
+        # one broadcast comparison, still written in the buffer directly
+        np.equal(mask[..., None], labels, out = out.view(np.bool_))
+        return out
+    # the channel of every pixel, then a single scatter of the 1s
+    flat = out.view(np.uint8).reshape(-1)
+    flat.fill(0)
+    channels = lut[mask.ravel()]
+    hit = channels < len(labels)
+    if hit.all():
+        channels += np.arange(0, flat.size, len(labels))
+        flat[channels] = 1
+    else:
+        flat[np.flatnonzero(hit) * len(labels) + channels[hit]] = 1
+    return out
+
+def pack_one_hot(onehot):
+    """
+    pack the binary channels into bits, 8 classes per byte
+    Args:
+        onehot: np.ndarray, the output of one_hot(), in (..., K) shape
+    Returns:
+        np.ndarray, uint8 in (..., ceil(K / 8)) shape
+    """
+    return np.packbits(onehot, axis = -1)
+
+def unpack_one_hot(packed, channels, dtype = np.uint8):
+    """
+    the reverse of pack_one_hot()
+    Args:
+        packed: np.ndarray, the output of pack_one_hot()
+        channels: int, K, the number of the classes packed
+        dtype: np.uint8 or bool
+    Returns:
+        np.ndarray, 0/1 in (..., K) shape
+    """
+    onehot = np.unpackbits(packed, axis = -1, count = channels)
+    return onehot.view(np.bool_) if np.dtype(dtype) == np.bool_ else onehot
@@ -2,19 +2,23 @@ import PIL.Image as Img
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
-import cv2
+from .color import unique_colors
+from .onehot import one_hot, pack_one_hot
+from .image_io import read_image
+from .crop import content_boxes
 
-def cvread(src):
+def cvread(src, reduce = 1):
     """
     read a image with cv2, I have to say the change in plt.imread is not that good...
     Args:
         src: the path of the image
+        reduce: int, 1, 2, 4 or 8, the image is decoded <reduce> times smaller, e.g. for a preview
     returns:
         np.ndarray, the image in 3-channel RGB format
     """
-    img = cv2.imread("/Users/alexli/Desktop/plant_book_mask.png")
-    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    return img
+    # the decoded images are cached read-only, see vision.image_io, the caller gets its own copy
+    img = read_image(src, reduce = reduce)
+    return img if img.flags.writeable else img.copy()
 
 def unique_color(img):
     """
@@ -24,21 +28,24 @@ def unique_color(img):
     Returns:
         np.ndarray, an array including all the individual colors
     """
+    # the uint8 RGB(A) colors are packed into integers, see vision.color
+    if img.dtype == np.uint8 and img.shape[2] <= 4:
+        return unique_colors(img)
     return np.unique(img.reshape(-1, img.shape[2]), axis=0)
 
-def crop_image(img):
+def crop_image(img, threshold = 0, background = 0):
     """
     crop all the 0 paddings aside
     input:
       img: np.ndarray, image to be cropped
+      threshold, background: the paddings are the pixels within <threshold> of <background>,
+                             see vision.crop.content_boxes(), which finds the boxes of
+                             a batch of images at once
     return:
-      img: np.ndarray, image cropped
+      img: np.ndarray, image cropped, a view of <img>
     """
-    _x = np.nonzero(np.any(img, axis = (0,2)))[0]
-    _y = np.nonzero(np.any(img, axis = (1,2)))[0]
-    _xs,_xf = _x[0],_x[-1]
-    _ys,_yf = _y[0],_y[-1]
-    return img[_ys:_yf,_xs:_xf]
+    (x0, y0, x1, y1), = content_boxes([img], threshold = threshold, background = background)
+    return img[y0:y1, x0:x1]
 
 def visualize_mask(img, mask, dictionary):
     """
@@ -65,45 +72,41 @@ def visualize_mask(img, mask, dictionary):
     plt.show()
     print(dictionary)
 
-def extract_binary_mask(mask, dictionary):
+def extract_binary_mask(mask, dictionary, dtype = np.uint8, packbits = False, out = None):
     """
     convert a integer mask to multi-channel binary mask
     arg:
-        mask, dictionary: output of col_gen.generate() method
+        mask, dictionary: output of col_gen.generate() method, the mask can be a batch in (N, H, W) shape
+        dtype: np.uint8 or bool, the dtype of the channels
+        packbits: bool, if True, the channels are packed into bits for storage,
+                  see vision.onehot.unpack_one_hot()
+        out: np.ndarray, optional, a preallocated buffer in mask.shape + (len(dictionary),) shape
     return:
-        np.ndarray, the binary mask in different channel
+        np.ndarray, the binary mask in different channel, 1 byte per pixel per channel,
+        or ceil(len(dictionary) / 8) bytes per pixel if packbits
     """
-    return np.stack([np.where(mask == i, 1, 0)for i in list(dictionary.values())], axis=-1)
+    onehot = one_hot(mask, dictionary.values(), dtype = dtype, out = out)
+    return pack_one_hot(onehot) if packbits else onehot
 
-def unify_image_format(img, output_format: str = "np"):
+def unify_image_format(img, output_format: str = "np", reduce = 1):
     """
     convert any image input into RGB np.ndarray type
     Args:
         img:
           string, the path of image/np.ndarray/PIL.Image object, the image object
         output_format: string, "np" or "PIL", see return
+        reduce: int, 1, 2, 4 or 8, a path is decoded <reduce> times smaller, e.g. for a preview
     Return:
         output:
           if output_format = "np", return RGB np.ndarray,
           if output_format = "PIL", return PIL image object
     """
     assert output_format in ["np", "PIL"]
-    # if it's a string
-    if type(img) == str:
-        output = np.array(Img.open(img).convert("RGB"))
-    # if it's a np.ndarray
-    elif type(img) == np.ndarray:
-        # if it's the correct format
-        if img.shape[2] == 3:
-            output = img
-        # if it's RGBA
-        else:
-            output = np.array(Img.fromarray(img).convert("RGB"))
-    # if it's a PIL
-    elif type(img) == PIL.PngImagePlugin.PngImageFile:
-        output = np.array(extract_image.convert("RGB"))
-    else:
-        raise TypeError("Invalid image input")
+    # the paths are decoded once and cached, the np.ndarray inputs are copied without their alpha channel,
+    # the PIL images are converted, see vision.image_io.read_image
+    output = read_image(img, reduce = reduce)
+    if not output.flags.writeable:
+        output = output.copy()
 
     if output_format == "PIL":
         output = Img.fromarray(output)